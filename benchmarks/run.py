@@ -0,0 +1,177 @@
+"""
+Benchmarks of the pybsrnqc hot paths on synthetic data
+
+    python benchmarks/run.py --sizes month year decade --output benchmarks/results.json
+
+Each benchmark is timed on a dataset of the size asked (1 month, 1 year or
+10 years of 1 minute data). The benchmarks whose cost grows too fast with the
+number of rows (exact KDE, coefficient sweeps) are skipped above a row limit,
+unless --no-limit is given. The results are written as JSON.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pybsrnqc.qcrad_vectorized as vqcr  # noqa: E402
+from pybsrnqc import automaticQC  # noqa: E402
+from pybsrnqc import coef_study as cs  # noqa: E402
+from pybsrnqc import open_data as od  # noqa: E402
+from pybsrnqc import plot_limits as pl  # noqa: E402
+from pybsrnqc import qc_functions as qcf  # noqa: E402
+from pybsrnqc.config import Coef, Station, load_conf  # noqa: E402
+from pybsrnqc.utils import getZenith  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic  # noqa: E402
+
+# size name : (first month, number of months)
+SIZES = {'month': ('201908', 1), 'year': ('201901', 12), 'decade': ('201001', 120)}
+
+# maximum number of rows of the benchmarks that do not scale linearly
+ROW_LIMITS = {'kde_computing': 100_000, 'calc_coef': 600_000, 'coef_variation': 600_000}
+
+# number of coefficients tried by the sweeps, as advised by coef_calculator
+NB_TRY = 200
+
+
+def timed(function, *args, **kwargs):
+    """Return the result of a call and its duration in seconds, the printed text being dropped"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        return result, time.perf_counter() - start
+
+
+def qc_rows(raw, SZA, coef):
+    """Scalar qcrad tests row by row, as in the original automatic QC"""
+    values = raw[['global2_avg', 'diffuse_avg', 'direct_avg', 'downward_avg', 'temperature']].to_numpy()
+    for (GSW, Dif, DirN, LWdn, Ta), sza in zip(values.tolist(), SZA.tolist()):
+        automaticQC.getQC(GSW, Dif, DirN, LWdn, Ta, sza, coef)
+
+
+def qc_vectorized(raw, SZA, coef):
+    """Same tests on whole columns"""
+    GSW, Dif, DirN = raw['global2_avg'], raw['diffuse_avg'], raw['direct_avg']
+    LWdn, Ta = raw['downward_avg'], raw['temperature']
+    return [vqcr.QC1(GSW, SZA, coef), vqcr.QC2(Dif, SZA, coef), vqcr.QC3(DirN, SZA, coef), vqcr.QC5(LWdn, coef),
+            vqcr.QC7(GSW, Dif, DirN, SZA), vqcr.QC8(Dif, GSW, SZA), vqcr.QC10(LWdn, Ta, coef), vqcr.QC19(Ta)]
+
+
+def run_size(size, files, station, coef, no_limit=False):
+    """Run all the benchmarks on the raw files of a size, return a list of results"""
+    results = []
+
+    def record(name, rows, function, *args, **kwargs):
+        limit = ROW_LIMITS.get(name)
+        if not no_limit and limit is not None and rows > limit:
+            results.append({'benchmark': name, 'size': size, 'rows': rows, 'seconds': None,
+                            'skipped': f'more than {limit} rows'})
+            print(f'{size:>7} {name:<20} {rows:>9} rows   skipped')
+            return None
+        result, seconds = timed(function, *args, **kwargs)
+        results.append({'benchmark': name, 'size': size, 'rows': rows, 'seconds': round(seconds, 4)})
+        print(f'{size:>7} {name:<20} {rows:>9} rows {seconds:9.3f} s')
+        return result
+
+    raw = pd.concat([pd.read_csv(filepath) for filepath in files], ignore_index=True)
+    rows = len(raw)
+
+    # solar zenith
+    SZA = record('getZenith', rows, getZenith, raw['timestamp'].tolist(), station.LAT, station.LON, station.ALT)
+    SZA = SZA.to_numpy()
+
+    # qcrad tests
+    record('qcrad_rows', rows, qc_rows, raw, SZA, coef)
+    record('qcrad_vectorized', rows, qc_vectorized, raw, SZA, coef)
+
+    # opening of the dataset
+    directory = os.path.dirname(files[0])
+    df = record('open_all', rows, od.open_all, directory, station=station).reset_index(drop=True)
+
+    # automatic QC files, written in a copy of the dataset
+    with tempfile.TemporaryDirectory() as tmp:
+        copies = []
+        for filepath in files:
+            copies.append(shutil.copy(filepath, tmp))
+
+        def generate():
+            for filepath in copies:
+                automaticQC.generateQCFiles(filepath, station, coef)
+
+        record('generateQCFiles', rows, generate)
+
+    # density and coefficient sweeps on the day time rows opened
+    QC = qcf.QC1()
+    step = (QC.coef_range[1] - QC.coef_range[0]) / NB_TRY
+    log_kernel = record('kde_computing', len(df), pl.kde_computing, df.copy(), QC, display=False, save=None)
+    log_kernel_binned = record('kde_binned', len(df), pl.kde_computing, df.copy(), QC, display=False, save=None,
+                               engine='binned')
+    # the sweeps use the binned density when the exact one is not computed : their cost does not depend on it
+    if log_kernel is None:
+        log_kernel = log_kernel_binned
+    threshold = float(np.quantile(log_kernel, 0.01))
+    record('calc_coef', len(df), cs.calc_coef, df.copy(), log_kernel, QC, threshold,
+           coef_range=QC.coef_range, step=step)
+    record('coef_variation', len(df), cs.coef_variation, df.copy(), log_kernel, QC,
+           coef_range=QC.coef_range, step=step, verbose=False, display=False)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of pybsrnqc on synthetic data')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['month', 'year'],
+                        help='sizes of the datasets (default: month year)')
+    parser.add_argument('--data', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'),
+                        help='directory of the generated datasets, kept between runs')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file of the results')
+    parser.add_argument('--conf', default=None, help='JSON file overriding the station and the coefficients')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--no-limit', action='store_true', help='run the slow benchmarks whatever the size')
+    args = parser.parse_args(argv)
+
+    if args.conf is None:
+        station, coef = Station(), Coef()
+    else:
+        station, coef = load_conf(args.conf)
+
+    results = []
+    for size in args.sizes:
+        start, months = SIZES[size]
+        files = synthetic.make_dataset(os.path.join(args.data, f'{size}_{args.seed}'), start, months,
+                                       station, args.seed)
+        results += run_size(size, files, station, coef, args.no_limit)
+
+    report = {'date': pd.Timestamp.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'pandas': pd.__version__,
+              'machine': platform.machine(),
+              'processor': platform.processor(),
+              'cpus': os.cpu_count(),
+              'station': {'LAT': station.LAT, 'LON': station.LON, 'ALT': station.ALT},
+              'seed': args.seed,
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Synthetic BSRN data for the benchmarks
+
+Generates realistic 1 minute raw files (GSW, DIF, DIR, LWdn, Ta) for a station :
+clear sky irradiance from the solar zenith, cloudy days, a daily and yearly
+temperature cycle, and injected outliers and missing values.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from pybsrnqc.config import Station
+from pybsrnqc.qcrad import REF
+from pybsrnqc.utils import getZenith
+
+COLUMNS = ['global2_avg', 'diffuse_avg', 'direct_avg', 'downward_avg']
+
+
+def make_month(year, month, station: Station = Station(), seed=0, outliers=0.002, missing=0.001):
+    """Return the raw dataframe of a month, as in a YYYYMM_raw.csv file"""
+    rng = np.random.default_rng([seed, year, month])
+    start = pd.Timestamp(year=year, month=month, day=1)
+    time = pd.date_range(start, start + pd.offsets.MonthBegin(1), freq='min', inclusive='left')
+    n = len(time)
+    sza = getZenith(time, station.LAT, station.LON, station.ALT, method='interpolated').to_numpy()
+    mu = np.clip(np.cos(np.radians(sza)), 0, None)
+    # clear sky (Haurwitz) and clearness index varying by day and by minute
+    ghi_clear = np.where(mu > 0, 1098 * mu * np.exp(-0.057 / np.maximum(mu, 1e-3)), 0)
+    day = (time - start).days.to_numpy()
+    kt_day = rng.uniform(0.3, 1.0, day.max() + 1)[day]
+    kt = np.clip(kt_day + 0.15 * rng.standard_normal(n) * (kt_day < 0.9), 0.05, 1.05)
+    gsw = ghi_clear * kt
+    diffuse_fraction = np.clip(1.1 - 1.2 * kt, 0.1, 1.0)
+    dif = gsw * diffuse_fraction
+    dirn = np.where(mu > 0.05, (gsw - dif) / np.maximum(mu, 0.05), 0)
+    # temperature with a yearly and a daily cycle, LWdn from an effective sky emissivity
+    doy = time.dayofyear.to_numpy()
+    hour = (time.hour + time.minute / 60).to_numpy()
+    ta = (22 + 4 * np.cos(2 * np.pi * (doy - 30) / 365) + 4 * np.sin(2 * np.pi * (hour - 9) / 24)
+          + rng.normal(0, 0.3, n))
+    emissivity = 0.75 + 0.2 * (1 - kt_day) + rng.normal(0, 0.01, n)
+    lwdn = emissivity * REF.BOLTZMANN * (ta + 273.15) ** 4
+    # measurement noise
+    values = {'global2_avg': gsw + rng.normal(0, 2, n), 'diffuse_avg': dif + rng.normal(0, 2, n),
+              'direct_avg': dirn + rng.normal(0, 2, n), 'downward_avg': lwdn + rng.normal(0, 2, n),
+              'temperature': ta}
+    # outliers : spikes, drops and negative values
+    for name in COLUMNS:
+        out = rng.random(n) < outliers
+        values[name][out] *= rng.choice([-0.05, 0.3, 1.8, 3.0], out.sum())
+    df = pd.DataFrame({'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')})
+    for name, value in values.items():
+        df[name] = np.round(value, 3)
+        if name in COLUMNS:
+            for suffix in ['std', 'min', 'max']:
+                df[name.replace('avg', suffix)] = np.round(np.abs(value) * {'std': 0.02, 'min': 0.97, 'max': 1.03}[suffix], 3)
+    # missing values
+    for name in values:
+        df.loc[rng.random(n) < missing, name] = np.nan
+    return df
+
+
+def make_dataset(path, start='201901', months=12, station: Station = Station(), seed=0):
+    """Write months YYYYMM_raw.csv files in a directory, beginning with the month start (YYYYMM)
+    Existing files are kept"""
+    os.makedirs(path, exist_ok=True)
+    first = pd.Timestamp(year=int(start[:4]), month=int(start[4:]), day=1)
+    files = []
+    for k in range(months):
+        date = first + pd.DateOffset(months=k)
+        filepath = os.path.join(path, f'{date.year}{date.month:02d}_raw.csv')
+        if not os.path.exists(filepath):
+            make_month(date.year, date.month, station, seed).to_csv(filepath, index=False)
+        files.append(filepath)
+    return files
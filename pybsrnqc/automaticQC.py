@@ -1,24 +1,40 @@
 #!/usr/bin/env python3
-import csv
+import contextlib
 import datetime
+import hashlib
+import io
+import json
 import os
+import time
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from bokeh.layouts import column
 from bokeh.models import ColumnDataSource
 from bokeh.models.tools import HoverTool
 from bokeh.plotting import figure, output_file, show
 
+from pybsrnqc import qcrad_vectorized as vqcr
 from pybsrnqc.config import Station, Coef, Header
+from pybsrnqc.profiling import profiled, stage
+from pybsrnqc.qc_store import save_qc
 from pybsrnqc.qcrad import QC1, QC2, QC3, QC5, QC7, QC8, QC10, QC19
-from pybsrnqc.utils import isfloat, getZenith
+from pybsrnqc.utils import isfloat, findRawFiles, getZenith, getStationZenith
 
 default_station = Station()
 default_coef = Coef()
 default_header = Header()
 
+# Columns of the aqc file set to 1 when a QC fails, in the order they are written
+AQC_COLUMNS = [("QC1", 2, ["global2_avg", "global2_std", "global2_min", "global2_max"]),
+               ("QC2", 2, ["diffuse_avg", "diffuse_std", "diffuse_min", "diffuse_max"]),
+               ("QC3", 2, ["direct_avg", "direct_std", "direct_min", "direct_max"]),
+               ("QC5", 2, ["downward_avg", "downward_std", "downward_min", "downward_max"]),
+               ("QC19", 0, ["temperature"])]
+
 
 def fix_values(row: OrderedDict, header: Header = default_header):
     GSW, Dif, DirN, LWdn, Ta, Td = None, None, None, None, None, None
@@ -42,13 +58,9 @@ def fix_values(row: OrderedDict, header: Header = default_header):
     return timestamp, GSW, Dif, DirN, LWdn, Ta
 
 
-def getRow(row: OrderedDict, zenith_serie, coef: Coef = default_coef, header: Header = default_header):
-    # get values of parameters
-    [timestamp, GSW, Dif, DirN, LWdn, Ta] = fix_values(row, header)
-    SZA = float(zenith_serie[timestamp])
-    # application of data quality control
-    qc_result = {
-        "timestamp": timestamp,
+def getQC(GSW, Dif, DirN, LWdn, Ta, SZA, coef: Coef = default_coef):
+    """Apply the QC tests to the values of one row"""
+    return {
         "QC1": QC1(GSW, SZA, coef),
         "QC2": QC2(Dif, SZA, coef),
         "QC3": QC3(DirN, SZA, coef),
@@ -58,6 +70,15 @@ def getRow(row: OrderedDict, zenith_serie, coef: Coef = default_coef, header: He
         "QC10": QC10(LWdn, Ta, coef),
         "QC19": QC19(Ta)
     }
+
+
+def getRow(row: OrderedDict, zenith_serie, coef: Coef = default_coef, header: Header = default_header):
+    # get values of parameters
+    [timestamp, GSW, Dif, DirN, LWdn, Ta] = fix_values(row, header)
+    SZA = float(zenith_serie[timestamp])
+    # application of data quality control
+    qc_result = {"timestamp": timestamp}
+    qc_result.update(getQC(GSW, Dif, DirN, LWdn, Ta, SZA, coef))
     # create row for aqc file
     row_aqc = row
     for key in row_aqc.keys():
@@ -90,33 +111,254 @@ def getRow(row: OrderedDict, zenith_serie, coef: Coef = default_coef, header: He
     return row_aqc, row_qcrad
 
 
-def generateQCFiles(filepath, station: Station = default_station, coef: Coef = default_coef):
-    """Create the 2 files _aqc.csv and _qrcad.csv"""
+def to_float(values):
+    """Convert a column of strings to floats the way isfloat/float do, NaN where it is not possible.
+    Return the floats and the mask of the values that could be converted"""
+    values = np.asarray(values, dtype=object)
+    floats = np.full(values.shape, np.nan)
+    # pandas finds the few values to check one by one, float makes the conversion
+    valid = ~np.isnan(pd.to_numeric(values, errors='coerce'))
+    for i in np.flatnonzero(~valid & (values != '')):
+        valid[i] = isfloat(values[i])
+    try:
+        floats[valid] = values[valid].astype(float)
+    except ValueError:
+        valid = np.array([isfloat(value) for value in values], dtype=bool)
+        floats[valid] = values[valid].astype(float)
+    return floats, valid
+
+
+@profiled()
+def getQCFrames(raw: pd.DataFrame, SZA, coef: Coef = default_coef, header: Header = default_header,
+                all_columns: bool = False):
+    """From the raw file read as strings and the zenith angles, return the aqc and qcrad dataframes
+    all_columns = True means the aqc columns missing in the raw file are all added, even if never flagged"""
+    # get values of parameters, a missing column or value is NaN
+    values, literal_nan = {}, np.zeros(raw.shape[0], dtype=bool)
+    for name in [header.GSW_NAME, header.DIF_NAME, header.DIR_NAME, header.LWDN_NAME, header.TA_NAME]:
+        if name in raw:
+            values[name], valid = to_float(raw[name])
+            literal_nan |= valid & np.isnan(values[name])
+        else:
+            values[name] = np.full(raw.shape[0], np.nan)
+    GSW, Dif, DirN = values[header.GSW_NAME], values[header.DIF_NAME], values[header.DIR_NAME]
+    LWdn, Ta = values[header.LWDN_NAME], values[header.TA_NAME] + 273.15
+    SZA = np.asarray(SZA, dtype=float)
+    # application of data quality control on whole columns
+    qc_result = {
+        "timestamp": raw[header.TIMESTAMP_NAME].to_numpy(),
+        "QC1": vqcr.QC1(GSW, SZA, coef),
+        "QC2": vqcr.QC2(Dif, SZA, coef),
+        "QC3": vqcr.QC3(DirN, SZA, coef),
+        "QC5": vqcr.QC5(LWdn, coef),
+        "QC7": vqcr.QC7(GSW, Dif, DirN, SZA),
+        "QC8": vqcr.QC8(Dif, GSW, SZA),
+        "QC10": vqcr.QC10(LWdn, Ta, coef),
+        "QC19": vqcr.QC19(Ta)
+    }
+    # a "nan" written in the file is a value for the tests, not a missing one : use the row functions
+    for i in np.flatnonzero(literal_nan):
+        row = fix_values(raw.iloc[i].to_dict(), header)
+        for name, flag in getQC(*row[1:], SZA[i], coef).items():
+            qc_result[name][i] = flag
+    df_qcrad = pd.DataFrame(qc_result)
+    # create aqc dataframe, columns missing in the raw file are added when first flagged
+    aqc = {key: raw[key].to_numpy() if key == "timestamp" else np.zeros(raw.shape[0], dtype=np.int64)
+           for key in raw.columns}
+    added = []
+    for name, limit, keys in AQC_COLUMNS:
+        failed = qc_result[name] > limit
+        for key in keys:
+            if key in aqc:
+                aqc[key][failed] = 1
+            elif failed.any() or all_columns:
+                aqc[key] = np.where(failed, 1., np.nan)
+                added.append((0 if all_columns else np.argmax(failed), len(added), key))
+    order = list(raw.columns) + [key for _, _, key in sorted(added)]
+    df_aqc = pd.DataFrame({key: aqc[key] for key in order}, columns=order)
+    return df_aqc, df_qcrad
+
+
+@profiled()
+def generateQCFiles(filepath, station: Station = default_station, coef: Coef = default_coef, chunksize: int = None,
+                    output: str = 'csv'):
+    """Create the 2 files _aqc.csv and _qrcad.csv
+    chunksize = None means the whole file is processed at once
+    chunksize = n means the file is read, checked and written n rows at a time, to bound the memory used
+    output = 'npz' means both results are saved in the binary file _qc.npz instead (see qc_store.load_qc)"""
     print(filepath)
     # Manage filenames
     FILE_BRUT = filepath
     FILE_AQC = os.path.splitext(FILE_BRUT.replace('_raw', ''))[0] + '_aqc.csv'
     FILE_QCRAD = os.path.splitext(FILE_BRUT.replace('_raw', ''))[0] + '_qcrad.csv'
-    # load input file into a DataFrame
-    file_raw = pd.read_csv(FILE_BRUT)
-    timestamp_list = file_raw.timestamp.to_list()
-    zenith_serie = getZenith(timestamp_list, station.LAT, station.LON, station.ALT)
-    # process input file
-    datapoints_qcrad, datapoints_aqc = [], []
-    with open(FILE_BRUT, 'r') as fileIn:
-        reader = csv.DictReader(fileIn, delimiter=',')
-        for row in reader:
-            (row_aqc, row_qcrad) = getRow(row, zenith_serie, coef)
-            datapoints_qcrad.append(row_qcrad)
-            datapoints_aqc.append(row_aqc)
-    # convert list of qcrad results into dataframe & save as a csv file
-    df_qcrad = pd.DataFrame(datapoints_qcrad)
-    df_qcrad.to_csv(FILE_QCRAD, index=False)
-    print("Successfully saved CSV file in", FILE_QCRAD)
-    # convert list of aqc results into dataframe & save as a csv file
-    df_aqc = pd.DataFrame(datapoints_aqc)
-    df_aqc.to_csv(FILE_AQC, index=False)
-    print("Successfully saved CSV file in", FILE_AQC)
+    FILE_QC = os.path.splitext(FILE_BRUT.replace('_raw', ''))[0] + '_qc.npz'
+    if output not in {'csv', 'npz'}:
+        raise ValueError(f"output should be 'csv' or 'npz', not {output!r}")
+    if output == 'npz' and chunksize is not None:
+        raise ValueError("The npz output is written at once, it cannot be used with chunksize")
+    # load input file into DataFrames of strings, as read by csv : the whole file or chunks of it
+    if chunksize is None:
+        with stage('automaticQC.read_csv'):
+            reader = contextlib.nullcontext([pd.read_csv(FILE_BRUT, dtype=str, keep_default_na=False)])
+    else:
+        reader = pd.read_csv(FILE_BRUT, dtype=str, keep_default_na=False, chunksize=chunksize)
+    with reader as chunks:
+        # the aqc columns of chunks have to be known from the first one : the missing ones are all written
+        first = True
+        for file_raw in chunks:
+            timestamp_list = file_raw[default_header.TIMESTAMP_NAME].to_list()
+            zenith_serie = getStationZenith(timestamp_list, station)
+            # process input file by columns
+            df_aqc, df_qcrad = getQCFrames(file_raw, zenith_serie, coef, all_columns=chunksize is not None)
+            with stage('automaticQC.write'):
+                if output == 'npz':
+                    save_qc(FILE_QC, df_aqc, df_qcrad)
+                else:
+                    # append the results of the chunk to the csv files
+                    mode = 'w' if first else 'a'
+                    df_qcrad.to_csv(FILE_QCRAD, index=False, mode=mode, header=first)
+                    df_aqc.to_csv(FILE_AQC, index=False, mode=mode, header=first)
+            first = False
+    if output == 'npz':
+        print("Successfully saved NPZ file in", FILE_QC)
+    else:
+        print("Successfully saved CSV file in", FILE_QCRAD)
+        print("Successfully saved CSV file in", FILE_AQC)
+
+
+@profiled()
+def updateQCFiles(filepath, station: Station = default_station, coef: Coef = default_coef):
+    """Update the files _aqc.csv and _qrcad.csv with the rows appended to the raw file since the last update
+    The position reached in the raw file is kept in the file _manifest.json. The files are rebuilt from the
+    start when the raw file was rewritten, when the station or the coefficients changed or when the files
+    _aqc.csv and _qrcad.csv were modified. An incomplete last line is left for the next update."""
+    print(filepath)
+    # Manage filenames
+    FILE_BRUT = filepath
+    FILE_AQC = os.path.splitext(FILE_BRUT.replace('_raw', ''))[0] + '_aqc.csv'
+    FILE_QCRAD = os.path.splitext(FILE_BRUT.replace('_raw', ''))[0] + '_qcrad.csv'
+    FILE_MANIFEST = os.path.splitext(FILE_BRUT.replace('_raw', ''))[0] + '_manifest.json'
+    manifest = None
+    if os.path.exists(FILE_MANIFEST):
+        with open(FILE_MANIFEST, 'r') as f:
+            manifest = json.load(f)
+    # settings changing the flags
+    settings = {'station': {key: station.__getattribute__(key) for key in ['LAT', 'LON', 'ALT', 'ZENITH_METHOD']},
+                'coef': json.loads(json.dumps(vars(coef)))}
+    with open(FILE_BRUT, 'rb') as fileIn:
+        header_line = fileIn.readline()
+        # check that what was processed is still the same
+        full = (manifest is None
+                or manifest['header'] != hashlib.sha256(header_line).hexdigest()
+                or any(manifest[key] != value for key, value in settings.items())
+                or os.path.getsize(FILE_BRUT) < manifest['offset']
+                or any(not os.path.exists(name) or os.path.getsize(name) != manifest['sizes'][name]
+                       for name in [FILE_AQC, FILE_QCRAD]))
+        if not full:
+            fileIn.seek(manifest['offset'] - manifest['last_line_size'])
+            full = manifest['last_line'] != hashlib.sha256(fileIn.read(manifest['last_line_size'])).hexdigest()
+        start = len(header_line) if full else manifest['offset']
+        fileIn.seek(start)
+        tail = fileIn.read()
+    # only the complete lines are processed
+    tail = tail[:tail.rfind(b'\n') + 1]
+    if len(tail) == 0:
+        print("No new rows in", FILE_BRUT)
+        return
+    file_raw = pd.read_csv(io.BytesIO(header_line + tail), dtype=str, keep_default_na=False)
+    timestamp_list = file_raw[default_header.TIMESTAMP_NAME].to_list()
+    zenith_serie = getStationZenith(timestamp_list, station)
+    df_aqc, df_qcrad = getQCFrames(file_raw, zenith_serie, coef)
+    if not full and not set(df_aqc.columns) <= set(manifest['aqc_columns']):
+        # a column missing in the raw file is flagged for the first time : the order of the columns changes
+        os.remove(FILE_MANIFEST)
+        return updateQCFiles(filepath, station, coef)
+    if full:
+        df_qcrad.to_csv(FILE_QCRAD, index=False)
+        df_aqc.to_csv(FILE_AQC, index=False)
+    else:
+        df_qcrad.to_csv(FILE_QCRAD, index=False, mode='a', header=False)
+        df_aqc.reindex(columns=manifest['aqc_columns']).to_csv(FILE_AQC, index=False, mode='a', header=False)
+    print("Successfully saved CSV file in", FILE_QCRAD, "(%d rows %s)" % (len(df_qcrad), "written" if full else "added"))
+    print("Successfully saved CSV file in", FILE_AQC, "(%d rows %s)" % (len(df_aqc), "written" if full else "added"))
+    # save the new state
+    last_line = tail[tail.rfind(b'\n', 0, len(tail) - 1) + 1:]
+    manifest = {'header': hashlib.sha256(header_line).hexdigest(),
+                'offset': start + len(tail),
+                'last_line': hashlib.sha256(last_line).hexdigest(),
+                'last_line_size': len(last_line),
+                'last_timestamp': timestamp_list[-1],
+                'aqc_columns': list(df_aqc.columns) if full else manifest['aqc_columns'],
+                'sizes': {name: os.path.getsize(name) for name in [FILE_AQC, FILE_QCRAD]}}
+    manifest.update(settings)
+    with open(FILE_MANIFEST + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(FILE_MANIFEST + '.tmp', FILE_MANIFEST)
+
+
+def timedQCFiles(filepath, station: Station = default_station, coef: Coef = default_coef, chunksize: int = None,
+                 incremental: bool = False, output: str = 'csv'):
+    """Run generateQCFiles (updateQCFiles if incremental) on a file and return the file, the time taken
+    and the error if any"""
+    start = time.perf_counter()
+    error = None
+    try:
+        if incremental:
+            updateQCFiles(filepath, station, coef)
+        else:
+            generateQCFiles(filepath, station, coef, chunksize, output)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    return filepath, time.perf_counter() - start, error
+
+
+def generateQCDirectory(path, station: Station = default_station, coef: Coef = default_coef, jobs: int = 1,
+                        chunksize: int = None, incremental: bool = False, output: str = 'csv'):
+    """Create the files _aqc.csv and _qrcad.csv of all the YYYYMM_raw.csv files of a directory
+    jobs : number of processes sharing the files
+    incremental = True means only the rows appended since the last update are processed (see updateQCFiles)
+    output : 'csv' or 'npz' (see generateQCFiles)
+    Return a dataframe with the time taken and the error of each file"""
+    if incremental and chunksize is not None:
+        raise ValueError("The incremental QC processes the appended rows at once, it cannot be used with chunksize")
+    if incremental and output == 'npz':
+        raise ValueError("The npz output is written at once, it cannot be used with incremental")
+    files = findRawFiles(path)
+    results = []
+
+    def progress(result):
+        results.append(result)
+        filepath, seconds, error = result
+        print(f'[{len(results)}/{len(files)}] {filepath} {seconds:.2f}s {error or "ok"}', flush=True)
+
+    if jobs == 1:
+        for filepath in files:
+            progress(timedQCFiles(filepath, station, coef, chunksize, incremental, output))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(timedQCFiles, filepath, station, coef, chunksize, incremental, output)
+                       for filepath in files]
+            for future in as_completed(futures):
+                progress(future.result())
+    df_summary = pd.DataFrame(results, columns=['file', 'seconds', 'error'])
+    return df_summary.sort_values('file').reset_index(drop=True)
+
+
+def compareZenithMethods(filepath, station: Station = default_station, coef: Coef = default_coef,
+                         method='interpolated'):
+    """Compare the zenith of a method with the nrel_numpy one on a raw file
+    Return, for QC1, QC2 and QC3, the maximal zenith error and the number and share of flags that change"""
+    file_raw = pd.read_csv(filepath, dtype=str, keep_default_na=False)
+    timestamp_list = file_raw[default_header.TIMESTAMP_NAME].to_list()
+    zenith_exact = getZenith(timestamp_list, station.LAT, station.LON, station.ALT)
+    zenith_method = getZenith(timestamp_list, station.LAT, station.LON, station.ALT, method=method)
+    df_qcrad_exact = getQCFrames(file_raw, zenith_exact, coef)[1]
+    df_qcrad_method = getQCFrames(file_raw, zenith_method, coef)[1]
+    names = ["QC1", "QC2", "QC3"]
+    changed = [int((df_qcrad_exact[name] != df_qcrad_method[name]).sum()) for name in names]
+    return pd.DataFrame({'max_zenith_error': np.abs(zenith_exact.to_numpy() - zenith_method.to_numpy()).max(),
+                         'changed_flags': changed,
+                         'changed_share': np.array(changed) / max(file_raw.shape[0], 1)}, index=names)
 
 
 def plotQCFiles(filepath):
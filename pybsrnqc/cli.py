@@ -0,0 +1,167 @@
+"""
+Command line interface of pybsrnqc
+
+pybsrnqc qc <dir> [--jobs N] [--chunksize N] [--incremental] [--format csv|npz] [--conf FILE]
+             [--profile FILE] [--profile-memory]
+pybsrnqc calibrate <dir> [--qcs QC1 ...] [--levels level_2 ...] [--threshold T] [--jobs N] [--nb-try N]
+                   [--bw-sel METHOD] [--kde-engine exact|binned|tree] [--kde-cache DIR]
+                   [--fit-size N] [--kde-progress] [--period YYYYMM YYYYMM] [--conf FILE]
+                   [--output FILE]
+pybsrnqc crossval <dir> [--qc QC1] [--level level_2] [--threshold T] [--folds K | --bootstrap B] [--seed S]
+                  [--jobs N] [--bw-sel METHOD] [--kde-engine exact|binned|tree] [--kde-cache DIR]
+                  [--fit-size N] [--kde-progress] [--period YYYYMM YYYYMM] [--conf FILE]
+                  [--output FILE]
+"""
+
+import argparse
+import sys
+
+from pybsrnqc import coef_calculator, profiling
+from pybsrnqc.automaticQC import generateQCDirectory
+from pybsrnqc.coef_calculator import LEVELS, QCS
+from pybsrnqc.config import Coef, Station, load_conf
+from pybsrnqc.kde import ENGINES
+from pybsrnqc.open_data import open_all
+
+
+def bandwidth(text):
+    """Bandwidth method of the KDE : scott, silverman or a scalar factor"""
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def qc(args):
+    """Generate the QC files of all the YYYYMM_raw.csv files of a directory"""
+    if args.conf is None:
+        station, coef = Station(), Coef()
+    else:
+        station, coef = load_conf(args.conf)
+    if args.profile is not None:
+        profiling.enable(memory=args.profile_memory)
+    df_summary = generateQCDirectory(args.path, station, coef, jobs=args.jobs, chunksize=args.chunksize,
+                                     incremental=args.incremental, output=args.format)
+    print()
+    print(df_summary.to_string(index=False))
+    print(f'{len(df_summary)} files in {df_summary.seconds.sum():.2f}s, {df_summary.error.notna().sum()} errors')
+    if args.profile is not None:
+        print()
+        profiling.print_report()
+        profiling.save_report(args.profile)
+    return 1 if df_summary.error.notna().any() else 0
+
+
+def calibrate(args):
+    """Compute the best coefficients of the QC on the data of a directory and write them in a conf file"""
+    if args.conf is None:
+        station = Station()
+    else:
+        station = load_conf(args.conf)[0]
+    df = open_all(args.path, period=args.period, station=station)
+    df_best = coef_calculator.calibrate(df, qcs=args.qcs, levels=args.levels, threshold=args.threshold,
+                                        jobs=args.jobs, nb_try=args.nb_try, bw_sel=args.bw_sel,
+                                        save=args.output, conf=args.conf, kde_engine=args.kde_engine,
+                                        kde_cache=args.kde_cache, fit_size=args.fit_size,
+                                        kde_progress=args.kde_progress)
+    print()
+    print(df_best.to_string(index=False))
+    return 0
+
+
+def crossval(args):
+    """Cross validate the best coefficients of a QC on the months of a directory"""
+    if args.conf is None:
+        station = Station()
+    else:
+        station = load_conf(args.conf)[0]
+    df = open_all(args.path, period=args.period, station=station)
+    df_folds, df_summary = coef_calculator.cross_validate(df, qc=args.qc, level=args.level, threshold=args.threshold,
+                                                          folds=args.folds, bootstrap=args.bootstrap, jobs=args.jobs,
+                                                          bw_sel=args.bw_sel, seed=args.seed,
+                                                          kde_engine=args.kde_engine, kde_cache=args.kde_cache,
+                                                          fit_size=args.fit_size, kde_progress=args.kde_progress)
+    print()
+    print(df_folds.to_string(index=False))
+    print()
+    print(df_summary.T.to_string())
+    if args.output is not None:
+        df_folds.to_csv(args.output, index=False)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pybsrnqc', description='BSRN data quality control')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_qc = subparsers.add_parser('qc', help='create the _aqc.csv and _qcrad.csv files of a directory')
+    parser_qc.add_argument('path', help='directory of the YYYYMM_raw.csv files')
+    parser_qc.add_argument('--jobs', type=int, default=1, help='number of processes (default 1)')
+    parser_qc.add_argument('--chunksize', type=int, default=None, help='rows read at a time (default all)')
+    parser_qc.add_argument('--incremental', action='store_true', help='only process the rows added since the last run')
+    parser_qc.add_argument('--format', choices=['csv', 'npz'], default='csv', help='output files (default csv)')
+    parser_qc.add_argument('--conf', default=None, help='JSON file in the format of qcrad_conf.json')
+    parser_qc.add_argument('--profile', default=None, metavar='FILE',
+                           help='write the time spent in each stage to a JSON file (stages of --jobs 1 only)')
+    parser_qc.add_argument('--profile-memory', action='store_true', help='also trace the peak memory of the stages')
+    parser_qc.set_defaults(func=qc)
+
+    parser_calibrate = subparsers.add_parser('calibrate', help='compute the best coefficients of the QC')
+    parser_calibrate.add_argument('path', help='directory of the YYYYMM_raw.csv files')
+    parser_calibrate.add_argument('--qcs', nargs='+', choices=list(QCS), default=None, help='QC studied (default all)')
+    parser_calibrate.add_argument('--levels', nargs='+', choices=LEVELS, default=None, help='levels (default both)')
+    parser_calibrate.add_argument('--threshold', type=float, default=-15., help='density threshold (default -15)')
+    parser_calibrate.add_argument('--jobs', type=int, default=1, help='number of processes (default 1)')
+    parser_calibrate.add_argument('--nb-try', type=int, default=None,
+                                  help='number of coefficients tried (default all, exact)')
+    parser_calibrate.add_argument('--bw-sel', type=bandwidth, default=None,
+                                  help='KDE bandwidth method or factor (default scott)')
+    parser_calibrate.add_argument('--kde-engine', choices=ENGINES, default='exact',
+                                  help='exact KDE, binned on a grid or dual-tree within 0.1%% (default exact)')
+    parser_calibrate.add_argument('--kde-cache', default=None, metavar='DIR',
+                                  help='directory where the KDE are kept for the next runs (default none)')
+    parser_calibrate.add_argument('--fit-size', type=int, default=None, metavar='N',
+                                  help='fit the exact KDE on N samples, stratified (default all)')
+    parser_calibrate.add_argument('--kde-progress', action='store_true',
+                                  help='print the progress of the exact KDE')
+    parser_calibrate.add_argument('--period', nargs=2, default=None, metavar='YYYYMM', help='first and last month')
+    parser_calibrate.add_argument('--conf', default=None, help='JSON file in the format of qcrad_conf.json')
+    parser_calibrate.add_argument('--output', default='qcrad_conf_calibrated.json',
+                                  help='JSON file written with the new coefficients')
+    parser_calibrate.set_defaults(func=calibrate)
+
+    parser_crossval = subparsers.add_parser('crossval', help='cross validate the best coefficients on the months')
+    parser_crossval.add_argument('path', help='directory of the YYYYMM_raw.csv files')
+    parser_crossval.add_argument('--qc', choices=list(QCS), default='QC1', help='QC studied (default QC1)')
+    parser_crossval.add_argument('--level', choices=LEVELS, default='level_2', help='level (default level_2)')
+    parser_crossval.add_argument('--threshold', type=float, default=-15., help='density threshold (default -15)')
+    folds = parser_crossval.add_mutually_exclusive_group()
+    folds.add_argument('--folds', type=int, default=None, help='folds of consecutive months (default one per month)')
+    folds.add_argument('--bootstrap', type=int, default=None, help='number of samples of the months instead of folds')
+    parser_crossval.add_argument('--seed', type=int, default=0, help='seed of the bootstrap (default 0)')
+    parser_crossval.add_argument('--jobs', type=int, default=1, help='number of processes (default 1)')
+    parser_crossval.add_argument('--bw-sel', type=bandwidth, default=None,
+                                 help='KDE bandwidth method or factor (default scott)')
+    parser_crossval.add_argument('--kde-engine', choices=ENGINES, default='exact',
+                                 help='exact KDE, binned on a grid or dual-tree within 0.1%% (default exact)')
+    parser_crossval.add_argument('--kde-cache', default=None, metavar='DIR',
+                                 help='directory where the KDE are kept for the next runs (default none)')
+    parser_crossval.add_argument('--fit-size', type=int, default=None, metavar='N',
+                                 help='fit the exact KDE on N samples, stratified (default all)')
+    parser_crossval.add_argument('--kde-progress', action='store_true',
+                                 help='print the progress of the exact KDE')
+    parser_crossval.add_argument('--period', nargs=2, default=None, metavar='YYYYMM', help='first and last month')
+    parser_crossval.add_argument('--conf', default=None, help='JSON file in the format of qcrad_conf.json')
+    parser_crossval.add_argument('--output', default=None, help='CSV file of the best coefficients of each fold')
+    parser_crossval.set_defaults(func=crossval)
+
+    args = parser.parse_args(argv)
+    if args.func is qc and args.incremental and args.chunksize is not None:
+        parser_qc.error('--incremental processes the appended rows at once, it cannot be used with --chunksize')
+    if args.func is qc and args.incremental and args.format == 'npz':
+        parser_qc.error('--incremental writes csv files, it cannot be used with --format npz')
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,19 +3,32 @@
 
 import importlib.resources
 import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
 
 from pybsrnqc import coef_study as cs
+from pybsrnqc import metrics
 from pybsrnqc import open_data as od
 from pybsrnqc import plot_limits as pl
 from pybsrnqc import qc_functions as qcf
-from pybsrnqc.config import Coef, Station
+from pybsrnqc.config import Coef, Station, write_conf
+from pybsrnqc.profiling import profiled
 
 # Coefficients initialisation
 # Get data conf from JSON file
 coef = Coef()
 
+# QC classes that can be calibrated
+QCS = {'QC1': qcf.QC1, 'QC2': qcf.QC2, 'QC3': qcf.QC3, 'QC5': qcf.QC5, 'QC10': qcf.QC10}
+LEVELS = ['level_1', 'level_2']
+
 
-def compute(path: str, bw_sel: str = None, station: Station = Station()):
+@profiled()
+def compute(path: str, bw_sel: str = None, station: Station = Station(), kde_cache: str = None):
+    """Interactive calibration of a QC, kde_cache being a directory where the KDE is kept (see kde_computing)"""
 
     qc = None
     while qc not in {"QC1", "QC2", "QC3", "QC5", "QC10"}:
@@ -41,9 +54,9 @@ def compute(path: str, bw_sel: str = None, station: Station = Station()):
 
     # Calculating kernel density for the dataset
     if qc.name in {'QC3', 'QC10'}:
-        log_kernel, selected = pl.kde_computing(df, qc, select=True, bw_sel=bw_sel)
+        log_kernel, selected = pl.kde_computing(df, qc, select=True, bw_sel=bw_sel, cache=kde_cache)
     else:
-        log_kernel = pl.kde_computing(df, qc, bw_sel=bw_sel)
+        log_kernel = pl.kde_computing(df, qc, bw_sel=bw_sel, cache=kde_cache)
 
     # Choosing the threshold
     threshold = float(input('Threshold for outliers : '))
@@ -100,3 +113,245 @@ def compute(path: str, bw_sel: str = None, station: Station = Station()):
         return qc.coefficients[level], float(score[qc.coefficients[level]]), qc.coefficients[level + '_min'], float(score_min[qc.coefficients[level + '_min']])
     else:
         return qc.coefficients[level], float(score[qc.coefficients[level]])
+
+
+def kde_pair(df, qc, bw_sel=None, kde_engine='exact', kde_cache=None, fit_size=None, kde_progress=False):
+    """Log KDE of the variables (varx, vary) of a QC, without display"""
+    return (qc.varx, qc.vary), pl.kde_computing(df, qc, display=False, save=None, bw_sel=bw_sel, engine=kde_engine,
+                                                cache=kde_cache, fit_size=fit_size, progress=kde_progress)
+
+
+def best_coefficients(df, log_kernel, qc, level, threshold, nb_try=None, selected=None):
+    """Best coefficients of a QC and a level (upper and lower limit for QC5 and QC10) as a list of dicts
+    nb_try = None means all the coefficients of the range are scored (calc_coef_exact),
+    otherwise nb_try coefficients of the range (calc_coef)"""
+    if nb_try is None:
+        scores = cs.calc_coef_exact(df, log_kernel, qc, threshold, level=level, verbose=False, selected=selected)
+    else:
+        kwargs = {'step': (qc.coef_range[1] - qc.coef_range[0]) / nb_try}
+        if qc.vary == 'downward_avg':
+            kwargs.update(coef_range_min=qc.coef_range_min,
+                          step_min=(qc.coef_range_min[1] - qc.coef_range_min[0]) / nb_try)
+        scores = cs.calc_coef(df, log_kernel, qc, threshold, level=level, coef_range=qc.coef_range,
+                              verbose=False, selected=selected, **kwargs)
+
+    rows = []
+    limits = [('upper', level, scores[1])]
+    if qc.vary == 'downward_avg':
+        limits.append(('lower', level + '_min', scores[3]))
+    for limit, key, line_max in limits:
+        # In the case there are several best scores, the first one
+        line = line_max.iloc[0]
+        name = qc.coefficients[key]
+        rows.append({'qc': qc.name, 'level': level, 'limit': limit, 'coefficient': name, 'value': float(line[name]),
+                     'f1_score': line['f1_score'], 'precision_score': line['precision_score'],
+                     'recall_score': line['recall_score'], 'accuracy_score': line['accuracy_score']})
+    return rows
+
+
+@profiled()
+def calibrate(df, qcs=None, levels=None, threshold=-15., jobs: int = 1, nb_try: int = None, bw_sel: str = None,
+              selected=None, save: str = None, conf: str = None, kde_engine: str = 'exact',
+              kde_cache: str = None, fit_size: int = None, kde_progress: bool = False):
+    """Best coefficients of several QC and levels, without interaction nor display
+    df : the data as given by open_data.open_all
+    qcs : names of the QC studied (all by default), levels : 'level_1' and/or 'level_2' (both by default)
+    threshold : density threshold of the outliers, or a dict QC name -> threshold with all the QC studied
+    jobs : number of processes sharing the KDE (one per couple of variables) then the QC and levels
+    nb_try : number of coefficients tried, None means all (see best_coefficients)
+    selected : dict QC name -> points [temperature, value] that are not outliers (QC3 and QC10)
+    save : path of a JSON file written in the format of qcrad_conf.json (conf, or the default one,
+    with the new coefficients)
+    kde_engine : 'exact', 'binned' or 'tree' (see plot_limits.kde_computing)
+    kde_cache : directory where the KDE are kept, so that a new calibration of the same data skips them
+    fit_size : number of samples the exact KDE is fitted on (stratified subsample), None means all
+    kde_progress : if True, the progress of the exact KDE is printed
+    Return a dataframe of the best coefficients"""
+    qcs = [QCS[name]() for name in (qcs or QCS)]
+    levels = levels or LEVELS
+    thresholds = threshold if isinstance(threshold, dict) else {qc.name: threshold for qc in qcs}
+    missing = [qc.name for qc in qcs if qc.name not in thresholds]
+    if missing:
+        raise ValueError(f'threshold has no value for {", ".join(missing)}')
+    selected = selected or {}
+
+    # only the columns used, the KDE being computed once for each couple of variables
+    columns = list(dict.fromkeys([qc.varx for qc in qcs] + [qc.vary for qc in qcs] + ['temperature', 'downward_avg']))
+    df = df[columns].reset_index(drop=True)
+    pairs = list({(qc.varx, qc.vary): qc for qc in qcs}.values())
+    tasks = [(qc, level) for qc in qcs for level in levels]
+
+    def run(function, args_list, progress):
+        if jobs == 1:
+            for args in args_list:
+                progress(function(*args))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(function, *args) for args in args_list]
+                for future in as_completed(futures):
+                    progress(future.result())
+
+    kernels = {}
+
+    def kde_done(result):
+        kernels[result[0]] = result[1]
+        print(f'[{len(kernels)}/{len(pairs)}] KDE of {result[0][1]} along {result[0][0]}', flush=True)
+
+    run(kde_pair, [(df[[qc.varx, qc.vary]], qc, bw_sel, kde_engine, kde_cache, fit_size, kde_progress)
+                   for qc in pairs], kde_done)
+
+    rows = []
+    done = []
+
+    def coef_done(result):
+        rows.extend(result)
+        done.append(result)
+        values = ', '.join(f'{row["coefficient"]} = {row["value"]:.4g}' for row in result)
+        print(f'[{len(done)}/{len(tasks)}] {result[0]["qc"]} {result[0]["level"]} : {values}', flush=True)
+
+    run(best_coefficients, [(df.copy(), kernels[(qc.varx, qc.vary)], qc, level, thresholds[qc.name], nb_try,
+                             selected.get(qc.name, [])) for qc, level in tasks], coef_done)
+
+    # same order as asked
+    order = {(qc.name, level): k for k, (qc, level) in enumerate(tasks)}
+    df_best = pd.DataFrame(sorted(rows, key=lambda row: (order[(row['qc'], row['level'])], row['limit'] != 'upper')))
+
+    if save is not None:
+        write_conf(save, dict(zip(df_best['coefficient'], df_best['value'])), base=conf)
+        print('Successfully saved JSON file in', save)
+
+    return df_best
+
+
+def month_folds(df, folds=None, bootstrap=None, seed=0):
+    """Folds of a cross validation by month
+    folds = None means one fold per month (leave one month out), folds = K splits the months in K folds of
+    consecutive months. bootstrap = B means B samples of the months drawn with replacement instead, the months
+    not drawn being the test rows
+    Return the months, the month of each row (index in months) and the number of times each month is in the
+    training rows of each fold (folds x months), 0 for the test months"""
+    timestamps = df['timestamp'] if 'timestamp' in df.columns else df.index.to_series()
+    months, groups = np.unique(timestamps.astype(str).str[:7].to_numpy(), return_inverse=True)
+    nb_months = len(months)
+
+    if bootstrap is not None:
+        rng = np.random.default_rng(seed)
+        train = np.stack([np.bincount(rng.integers(nb_months, size=nb_months), minlength=nb_months)
+                          for _ in range(bootstrap)])
+    else:
+        folds = nb_months if folds is None else folds
+        if not 2 <= folds <= nb_months:
+            raise ValueError(f'the number of folds should be between 2 and the number of months ({nb_months})')
+        train = np.ones((folds, nb_months), dtype=np.int64)
+        for k, fold in enumerate(np.array_split(np.arange(nb_months), folds)):
+            train[k, fold] = 0
+    return months, groups, train
+
+
+def fold_scores(groups, y_true, criticals, train, limits):
+    """Best coefficient of each limit on the training rows of a fold and its scores on the test rows
+    groups : month of each row, y_true : outliers by density, criticals : critical coefficients of each limit
+    train : number of times each month is in the training rows, the other months being the test rows
+    limits : (limit, coefficient name, coef_range, lower) of each limit"""
+    weights = train[groups]
+    test = (weights == 0).astype(np.int64)
+    rows = []
+    for (limit, name, coef_range, lower), critical in zip(limits, criticals):
+        df_scores = cs.exact_scores(critical, y_true, name, coef_range, lower, weights)
+        # In the case there are several best scores, the first one
+        line = df_scores.loc[df_scores['f1_score'].idxmax()]
+        test_scores = metrics.scores(*cs.confusion_counts(critical, y_true, [line[name]], lower, test))
+        rows.append({'limit': limit, 'coefficient': name, 'value': float(line[name]), 'f1_score': line['f1_score'],
+                     'test_rows': int(test.sum()),
+                     'test_f1_score': float(test_scores['f1_score'][0]) if test.any() else np.nan})
+    return rows
+
+
+# Arrays of the cross validation in the worker processes, read in shared memory
+_shared = {}
+
+
+def _share(arrays):
+    """Copy the arrays in shared memory blocks, return the blocks and their description for _attach"""
+    blocks, description = [], []
+    for array in arrays:
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        description.append((block.name, array.shape, array.dtype.str))
+    return blocks, description
+
+
+def _attach(description):
+    """Read the shared arrays without copy, once per worker process"""
+    _shared['blocks'] = [shared_memory.SharedMemory(name=name) for name, _, _ in description]
+    _shared['arrays'] = [np.ndarray(shape, dtype=dtype, buffer=block.buf)
+                         for block, (_, shape, dtype) in zip(_shared['blocks'], description)]
+
+
+def _shared_fold_scores(train, limits):
+    groups, y_true, *criticals = _shared['arrays']
+    return fold_scores(groups, y_true, criticals, train, limits)
+
+
+@profiled()
+def cross_validate(df, qc='QC1', level='level_2', threshold=-15., folds=None, bootstrap=None, jobs: int = 1,
+                   log_kernel=None, bw_sel: str = None, selected=None, seed: int = 0, kde_engine: str = 'exact',
+                   kde_cache: str = None, fit_size: int = None, kde_progress: bool = False):
+    """Stability of the best coefficients of a QC from month to month
+    The best coefficients (all the coefficients of the range, as calc_coef_exact) are computed on the training
+    months of each fold and scored on the test months (see month_folds for folds and bootstrap)
+    The KDE (log_kernel, computed with kde_engine, fitted on fit_size samples and kept in kde_cache if None) and
+    the outliers by density are the ones of the whole dataset, as well as the critical coefficients : the folds
+    only count them on their rows
+    jobs : number of processes, the arrays being shared with them in shared memory (and threads of the exact KDE)
+    kde_progress : if True, the progress of the exact KDE is printed
+    Return a dataframe of the best coefficients of each fold and their distribution (describe of the
+    values and of the f1 scores of the test months) for each coefficient"""
+    qc = QCS[qc]()
+    if 'timestamp' not in df.columns:
+        # timestamps as index, as given by open_all(select_day=True)
+        df = df.reset_index()
+    df = df[list(dict.fromkeys(['timestamp', qc.varx, qc.vary, 'temperature', 'downward_avg']))]
+    df = df.reset_index(drop=True)
+    if log_kernel is None:
+        log_kernel = pl.kde_computing(df, qc, display=False, save=None, bw_sel=bw_sel, engine=kde_engine,
+                                     jobs=jobs, cache=kde_cache, fit_size=fit_size,
+                                     progress=kde_progress)
+
+    months, groups, train = month_folds(df, folds, bootstrap, seed)
+    cs.label_density(df, log_kernel, qc, threshold, [] if selected is None else selected)
+    y_true = df['out_density'].to_numpy(dtype=np.int8)
+
+    limits = [('upper', qc.coefficients[level], qc.coef_range, False)]
+    if qc.vary == 'downward_avg':
+        limits.append(('lower', qc.coefficients[level + '_min'], qc.coef_range_min, True))
+    criticals = [cs.critical_coef(df, qc, level, lower=lower) for _, _, _, lower in limits]
+
+    rows = []
+
+    def fold_done(k, result):
+        test_months = ' '.join(months[train[k] == 0])
+        rows.extend({'fold': k, 'test_months': test_months, **row} for row in result)
+        values = ', '.join(f'{row["coefficient"]} = {row["value"]:.4g} (test f1 {row["test_f1_score"]:.3f})'
+                           for row in result)
+        print(f'[{len(rows) // len(limits)}/{len(train)}] {values}', flush=True)
+
+    if jobs == 1:
+        for k in range(len(train)):
+            fold_done(k, fold_scores(groups, y_true, criticals, train[k], limits))
+    else:
+        blocks, description = _share([groups, y_true] + criticals)
+        try:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_attach, initargs=(description,)) as executor:
+                futures = {executor.submit(_shared_fold_scores, train[k], limits): k for k in range(len(train))}
+                for future in as_completed(futures):
+                    fold_done(futures[future], future.result())
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    df_folds = pd.DataFrame(sorted(rows, key=lambda row: (row['fold'], row['limit'] != 'upper')))
+    df_summary = df_folds.groupby('coefficient', sort=False)[['value', 'test_f1_score']].describe()
+    return df_folds, df_summary
@@ -8,17 +8,248 @@ import json
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
+from pybsrnqc import metrics
 from pybsrnqc.config import Coef 
+from pybsrnqc.profiling import profiled, stage
 
 # -----------------------------------------------------------------------------------------------------------
 # Initialisation of a set of coefficients
 # Get data conf from JSON file
 
 dic_coefs = Coef()
+
+# Number of (sample, coefficient) flags computed at once by the coefficient sweeps
+BLOCK_SIZE = 2 ** 21
 # ------------------------------------------------------------------------------------------------------------
 
 
+def sweep_flags(df, QC, coef_name, values, block_size=BLOCK_SIZE):
+    """ Yield the flags of the samples of df for each coefficient value
+    The values are processed by blocks : each block gives an array (coefficients x samples)
+    of at most block_size flags, the same as QC.calc_lim(df, coef)[3] for each coefficient """
+
+    X = df[QC.varx].to_numpy(dtype=float)[np.newaxis, :]
+    Y = df[QC.vary].to_numpy(dtype=float)[np.newaxis, :]
+    values = np.asarray(values, dtype=float)
+    nb_values = max(1, block_size // max(1, X.shape[1]))
+
+    for start in range(0, len(values), nb_values):
+        dic = Coef()
+        dic.__setattr__(coef_name, values[start:start + nb_values, np.newaxis])
+        with stage('coef_study.sweep_flags'):
+            flags = QC.lab(Y, X, dic)
+        yield flags
+
+
+# Scores given for each coefficient
+SCORES = ['accuracy_score', 'precision_score', 'recall_score', 'f1_score']
+
+# Bounds of the coefficients searched for the critical ones
+COEF_LIMIT = 1e300
+
+
+def _out_flags(level, lower=False):
+    """ Flags counted as outliers for a level, on the upper or the lower limit """
+    if lower:
+        return [3] if level == 'level_2' else [1, 3]
+    return [4] if level == 'level_2' else [2, 4]
+
+
+def _float_key(x):
+    """ Integers in the same order as the floats, two consecutive floats giving consecutive integers """
+    i = np.asarray(x, dtype=float).view(np.int64)
+    return np.where(i < 0, -(i & np.int64(0x7FFFFFFFFFFFFFFF)), i)
+
+
+def _key_float(key):
+    """ Inverse of _float_key """
+    return np.where(key < 0, (-key) | np.int64(-2 ** 63), key).view(np.float64)
+
+
+def critical_coef(df, QC, level='level_2', lower=False, out_flags=None, others=None):
+    """ Critical coefficient of each sample of df, where its flag changes
+    For the upper limit the sample is an outlier for all the coefficients <= its critical coefficient,
+    for the lower limit (lower=True) for all the coefficients >= it. -inf and +inf are the samples never
+    or always outliers. The closed form QC.critical is corrected to the exact float where the flag
+    given by QC.lab changes, so that the counts are the same as the ones of the flags
+    out_flags : flags of the outliers, the ones of the level by default
+    others : dict of the other coefficients changed (name -> value), the ones of the configuration by default """
+
+    coef_name = QC.coefficients[level + '_min' if lower else level]
+    if out_flags is None:
+        out_flags = _out_flags(level, lower)
+    X = df[QC.varx].to_numpy(dtype=float)
+    Y = df[QC.vary].to_numpy(dtype=float)
+
+    def flagged(coef, index):
+        dic = Coef()
+        for name, value in (others or {}).items():
+            dic.__setattr__(name, value)
+        dic.__setattr__(coef_name, coef)
+        return np.isin(QC.lab(Y[index], X[index], dic), out_flags)
+
+    # the flag is the same below a and the other one above b (outlier below a for the upper limit)
+    index = np.arange(len(X))
+    estimate = np.broadcast_to(np.asarray(QC.critical(Y, X, coef_name), dtype=float), X.shape)
+    delta = 1e-7 * (np.abs(estimate) + 1)
+    a, b = estimate - delta, estimate + delta
+    bracket = np.isfinite(estimate)
+    bracket[bracket] = ((flagged(a[bracket], index[bracket]) != lower)
+                        & (flagged(b[bracket], index[bracket]) == lower))
+    # otherwise the whole range of the coefficients is searched
+    a[~bracket], b[~bracket] = -COEF_LIMIT, COEF_LIMIT
+    critical = np.empty(len(X))
+    constant = np.zeros(len(X), dtype=bool)
+    flagged_a = flagged(a[~bracket], index[~bracket])
+    constant[~bracket] = flagged_a == flagged(b[~bracket], index[~bracket])
+    always = flagged_a[constant[~bracket]]
+    critical[constant] = np.where(always, -np.inf, np.inf) if lower else np.where(always, np.inf, -np.inf)
+
+    # bisection on the floats between a and b
+    index = index[~constant]
+    key_a, key_b = _float_key(a[index]), _float_key(b[index])
+    while True:
+        search = np.flatnonzero(key_b - key_a > 1)
+        if len(search) == 0:
+            break
+        middle = (key_a[search] >> 1) + (key_b[search] >> 1) + (key_a[search] & key_b[search] & 1)
+        side_a = flagged(_key_float(middle), index[search]) != lower
+        key_a[search[side_a]] = middle[side_a]
+        key_b[search[~side_a]] = middle[~side_a]
+    critical[index] = _key_float(key_b if lower else key_a)
+
+    return critical
+
+
+def flagged_sums(critical, weights, values, lower=False):
+    """ Sums of the weights of the samples that are outliers for each coefficient value
+    The samples are sorted once by critical coefficient so that the outliers of a value are a prefix :
+    the sums are read in the cumulative sums of the weights (one column per weight) """
+
+    critical = np.asarray(critical, dtype=float)
+    weights = np.asarray(weights).reshape(len(critical), -1)
+    values = np.asarray(values, dtype=float)
+
+    # order where the outliers come first : increasing for the lower limit, decreasing for the upper one
+    order = np.argsort(critical if lower else -critical, kind='stable')
+    cum_weights = np.concatenate([np.zeros((1, weights.shape[1]), dtype=weights.dtype),
+                                  np.cumsum(weights[order], axis=0)])
+
+    # number of outliers for each value
+    sorted_critical = np.sort(critical)
+    if lower:
+        nb_out = np.searchsorted(sorted_critical, values, side='right')
+    else:
+        nb_out = len(critical) - np.searchsorted(sorted_critical, values, side='left')
+
+    return cum_weights[nb_out]
+
+
+def confusion_counts(critical, y_true, values, lower=False, weights=None):
+    """ Exact numbers of true positives, false positives, false negatives and true negatives
+    for each coefficient value, from the critical coefficients and the outliers by density (y_true)
+    weights : number of times each sample is counted (integers), 1 by default """
+
+    y_true = np.asarray(y_true) == 1
+    weights = np.ones(len(y_true), dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+    sums = flagged_sums(critical, np.stack([weights, weights * y_true], axis=1), values, lower)
+    flagged, tp = sums[:, 0], sums[:, 1]
+
+    fp = flagged - tp
+    fn = (weights * y_true).sum() - tp
+    tn = weights.sum() - tp - fp - fn
+    return tp, fp, fn, tn
+
+
+def kde_indicators(critical, log_kde, values, lower=False):
+    """ Number of outliers, sum, mean and standard deviation of their log density for each coefficient value
+    From running sums of log_kde and of its square (centered for the precision) """
+
+    log_kde = np.asarray(log_kde, dtype=float)
+    finite = np.isfinite(log_kde)
+    shift = log_kde[finite].mean() if finite.any() else 0.
+    weights = np.stack([np.ones(len(log_kde)), log_kde, log_kde - shift, (log_kde - shift) ** 2], axis=1)
+    nb_out, kde_sum, sum_shifted, sum_squares = flagged_sums(critical, weights, values, lower).T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kde_mean = np.where(nb_out > 0, kde_sum / nb_out, np.nan)
+        variance = (sum_squares - sum_shifted ** 2 / nb_out) / (nb_out - 1)
+        # a variance under the rounding error of the sums is 0 (identical values)
+        noise = 4 * np.finfo(float).eps * sum_squares / (nb_out - 1)
+        variance = np.where((variance <= noise) & np.isfinite(noise), 0., variance)
+        kde_std = np.where(nb_out > 1, np.sqrt(variance), np.nan)
+    return nb_out, kde_sum, kde_mean, kde_std
+
+
+def exact_scores(critical, y_true, coef_name, coef_range, lower=False, weights=None):
+    """ Scores for all the coefficients of coef_range, one line per interval of coefficients
+    giving the same outliers : from coef_from to coef_to, coef_name being the middle
+    weights : number of times each sample is counted (see confusion_counts) """
+
+    r0, r1 = coef_range
+    bounds = np.concatenate([[r0], np.unique(critical[(critical > r0) & (critical < r1)]), [r1]])
+
+    if lower:
+        # the outliers change at each critical coefficient : [bounds[k], bounds[k + 1]) then r1
+        starts = np.append(bounds[:-1], r1)
+        ends = np.append(bounds[1:], r1)
+        points = starts
+    else:
+        # the outliers change just above each critical coefficient : r0 then (bounds[k], bounds[k + 1]]
+        starts = np.append(r0, bounds[:-1])
+        ends = np.append(r0, bounds[1:])
+        points = ends
+
+    tp, fp, fn, tn = confusion_counts(critical, y_true, points, lower, weights)
+
+    # consecutive intervals with the same outliers are merged
+    first = np.flatnonzero(np.append(True, (tp[1:] != tp[:-1]) | (fp[1:] != fp[:-1])))
+    last = np.append(first[1:] - 1, len(points) - 1)
+    scores = metrics.scores(tp[first], fp[first], fn[first], tn[first])
+
+    df_scores = pd.DataFrame({coef_name: (starts[first] + ends[last]) / 2,
+                              'coef_from': starts[first],
+                              'coef_to': ends[last],
+                              'accuracy_score': scores['accuracy_score'],
+                              'precision_score': scores['precision_score'],
+                              'recall_score': scores['recall_score'],
+                              'f1_score': scores['f1_score']})
+    return df_scores
+
+
+def joint_scores(critical, critical_min, y_true, values, values_min):
+    """ Scores of the union of the outliers of the upper and the lower limit for each couple of coefficients
+    (values[i], values_min[j]), as a dict of arrays (len(values) x len(values_min)) named as in metrics.scores
+    The values are increasing. The samples are counted in a 2D histogram : number of upper coefficients for which
+    they are outliers x first lower coefficient for which they are outliers. The samples outliers of both limits
+    are read in its cumulative sums, the union is the upper outliers + the lower ones - the ones of both """
+
+    y_true = np.asarray(y_true) == 1
+    values, values_min = np.asarray(values, dtype=float), np.asarray(values_min, dtype=float)
+    weights = np.stack([np.ones(len(y_true), dtype=np.int64), y_true], axis=1)
+
+    # outliers for values[:nb_up] and for values_min[first_min:]
+    nb_up = np.searchsorted(values, critical, side='right')
+    first_min = np.searchsorted(values_min, critical_min, side='left')
+    size = len(values_min) + 1
+    codes = nb_up * size + first_min
+    histogram = np.stack([np.bincount(codes, weights=weights[:, k], minlength=(len(values) + 1) * size)
+                          for k in range(2)], axis=-1).reshape(len(values) + 1, size, 2).astype(np.int64)
+
+    # both[i, j] : samples with nb_up > i and first_min <= j
+    both = np.cumsum(np.cumsum(histogram[::-1], axis=0)[::-1][1:], axis=1)[:, :-1]
+    upper = histogram.sum(axis=1)[::-1].cumsum(axis=0)[::-1][1:]
+    lower = histogram.sum(axis=0).cumsum(axis=0)[:-1]
+    union = upper[:, np.newaxis, :] + lower[np.newaxis, :, :] - both
+    flagged, tp = union[..., 0], union[..., 1]
+
+    fp = flagged - tp
+    fn = y_true.sum() - tp
+    tn = len(y_true) - tp - fp - fn
+    return metrics.scores(tp, fp, fn, tn)
+
+
+@profiled()
 def coef_variation(df, log_kernel, QC, level='level_2', coef_range=[0.0, 1.2], step=0.01, coef_range_min=None, step_min=None, verbose=True, display=True):
 
     """ Function which calculates certain indicators
@@ -29,92 +260,40 @@ def coef_variation(df, log_kernel, QC, level='level_2', coef_range=[0.0, 1.2], s
     df_min = df.copy()
     df_min = df_min.loc[df_min['downward_avg'] <= 400]
 
-    # Name of the coefficient we study
-    coef_name = QC.coefficients[level]
-
     # Values of the coefficients we study
     values_c = list(np.arange(coef_range[0], coef_range[1], step))
 
-    # Initialisation of the indicators
-    the_coefs = []
-    nb_out = []
-    kde_means = []
-    kde_sums = []
-    kde_stds = []
-
     if QC.vary == 'downward_avg':
 
-        coef_name_min = QC.coefficients[level + '_min']
         values_c_min = list(np.arange(coef_range_min[0], coef_range_min[1], step_min))
 
-        # Initialisation of the indicators
-        the_coefs_min = []
-        nb_out_min = []
-        kde_means_min = []
-        kde_sums_min = []
-        kde_stds_min = []
-
     # Visualization of the computation
     if verbose:
         for k in range(len(values_c)):
             print('.', end='')
         print()
 
-    # Calculus of the indicators for each coefficients
-    for coef in values_c:
-
-        # Generation of the new coefficients
-
-        dic = Coef()
-        dic.__setattr__(coef_name, coef)
-
-        # Generation of the outliers according to the limits linked to the coefficients
-
-        df_lim = df.copy()
-        df_lim['flag'] = QC.calc_lim(df, coef=dic)[3]
-        df_lim['out_coef'] = np.zeros(df_lim.shape[0],)
-        df_lim.loc[df_lim.flag == 4, "out_coef"] = 1
+    # Calculus of the indicators for all the coefficients : the outliers (flag 4) of a coefficient
+    # are the samples whose critical coefficient is above it
+    with stage('coef_study.critical_coef'):
+        critical = critical_coef(df, QC, level, out_flags=[4])
+    nb_out, kde_sums, kde_means, kde_stds = kde_indicators(critical, df['log_kde'], values_c)
+    the_coefs = values_c
 
-        df_lim_out = df_lim.loc[df_lim['out_coef'] == 1]
-        kde_mean = df_lim_out['log_kde'].mean()
-        kde_sum = df_lim_out['log_kde'].sum()
-        kde_std = df_lim_out['log_kde'].std()
-
-        nb_out.append(df_lim['out_coef'].sum())
-        kde_means.append(kde_mean)
-        kde_sums.append(kde_sum)
-        the_coefs.append(coef)
-        kde_stds.append(kde_std)
-
-        # Visualization of the computation
-        print('-', end='')
+    # Visualization of the computation
+    print('-' * len(values_c), end='')
 
     if QC.vary == 'downward_avg':
-        for coef_min in values_c_min:
 
-            # Generation of the new coefficients
-            dic = Coef()
-            dic.__setattr__(coef_name_min, coef_min)
+        # Same for the lower limit (flag 3), the outliers being under the critical coefficient
+        with stage('coef_study.critical_coef'):
+            critical_min = critical_coef(df_min, QC, level, lower=True, out_flags=[3])
+        nb_out_min, kde_sums_min, kde_means_min, kde_stds_min = kde_indicators(critical_min, df_min['log_kde'],
+                                                                               values_c_min, lower=True)
+        the_coefs_min = values_c_min
 
-            # Generation of the outliers according to the limits linked to the coefficients
-            df_lim = df_min.copy()
-            df_lim['flag'] = QC.calc_lim(df_min, coef=dic)[3]
-            df_lim['out_coef'] = np.zeros(df_lim.shape[0],)
-            df_lim.loc[df_lim.flag == 3, "out_coef"] = 1
-
-            df_lim_out = df_lim.loc[df_lim['out_coef'] == 1]
-            kde_mean = df_lim_out['log_kde'].mean()
-            kde_sum = df_lim_out['log_kde'].sum()
-            kde_std = df_lim_out['log_kde'].std()
-
-            nb_out_min.append(df_lim['out_coef'].sum())
-            kde_means_min.append(kde_mean)
-            kde_sums_min.append(kde_sum)
-            the_coefs_min.append(coef_min)
-            kde_stds_min.append(kde_std)
-
-            # Visualization of the computation
-            print('-', end='')
+        # Visualization of the computation
+        print('-' * len(values_c_min), end='')
 
     tab = np.zeros((len(values_c), 4))
     df_var = pd.DataFrame(tab)
@@ -212,31 +391,21 @@ def coef_variation(df, log_kernel, QC, level='level_2', coef_range=[0.0, 1.2], s
     return df_var
 
 
+@profiled()
 def threshold_var(df, log_kernel, threshold_range=None, step=0.1, display=True):
 
+    """ Number of outliers by density according to the threshold """
+
     if threshold_range is None:
 
         threshold_range = [np.min(log_kernel), np.max(log_kernel)]
 
     values_t = list(np.arange(threshold_range[0], threshold_range[1], step))
 
-    # Gettinf KDE density
-    df['log_kde'] = log_kernel
-
-    # Initialisation
-    nb_out_density = []
-
-    for threshold in values_t:
-
-        df['out_density'] = np.zeros(df.shape[0],)
-        df['out_density_min'] = np.zeros(df.shape[0],)
-
-        # Labeling according to the chosen threshold
-        df.loc[df.log_kde <= threshold, "out_density"] = 1
-        df_min = df.copy()
-        df_min.loc[(df['downward_avg'] <= 350) & (df.log_kde <= threshold), 'out_density_min'] = 1
-
-        nb_out_density.append(df['out_density'].sum())
+    # Number of outliers (log density <= threshold) for all the thresholds from the sorted densities,
+    # df is left unchanged
+    sorted_kde = np.sort(np.asarray(log_kernel, dtype=float))
+    nb_out_density = np.searchsorted(sorted_kde, values_t, side='right').astype(float)
 
     tab = np.zeros((len(values_t), 1))
     df_var = pd.DataFrame(tab)
@@ -258,102 +427,113 @@ def threshold_var(df, log_kernel, threshold_range=None, step=0.1, display=True):
 
 # ---------------------------------------------------------------------------------------------------------------------
 
-def calc_coef(df, log_kernel, QC, threshold, level='level_2', coef_range=[0.0, 1.2], coef_range_min=[0.0, 1.2], step=0.01, step_min=0.1, verbose=True, selected=None):
+def sweep_scores(df, QC, coef_name, values, out_flags, y_true):
+    """ Scores of the outliers (flags in out_flags) against y_true for each coefficient value, as a dict of lists """
+
+    scores = {name: [] for name in SCORES}
+    for flags in sweep_flags(df, QC, coef_name, values):
+        # Scores of the block of coefficients from their confusion counts
+        with stage('coef_study.scores'):
+            block = metrics.batch_scores(y_true, np.isin(flags, out_flags))
+        for name in SCORES:
+            scores[name].extend(block[name])
+    return scores
+
+
+def adaptive_search(evaluate, coef_range, step, tol, refine=10):
+    """ Coarse to fine search of the best f1 score
+    The range is scanned with step, then around the best coefficient (+/- the previous step) with a step
+    refine times smaller, until the step is under tol. evaluate gives the scores of values (see sweep_scores).
+    Return all the values evaluated (sorted) and their scores """
+
+    values = np.arange(coef_range[0], coef_range[1], step)
+    scores = {name: np.asarray(score) for name, score in evaluate(values).items()}
+
+    while step > tol:
+        best = values[np.argmax(scores['f1_score'])]
+        step = max(step / refine, tol)
+        new_values = np.arange(max(best - step * refine, coef_range[0]), min(best + step * refine, coef_range[1]), step)
+        # values already evaluated, up to the rounding errors of arange (0.3 and 0.30000000000000004)
+        evaluated = np.isclose(new_values[:, None], values[None, :], rtol=0, atol=step / 2).any(axis=1)
+        new_values = new_values[~evaluated]
+        if len(new_values) > 0:
+            new_scores = evaluate(new_values)
+            values = np.concatenate([values, new_values])
+            scores = {name: np.concatenate([score, new_scores[name]]) for name, score in scores.items()}
+
+    order = np.argsort(values, kind='stable')
+    return list(values[order]), {name: list(score[order]) for name, score in scores.items()}
+
+
+def label_density(df, log_kernel, QC, threshold, selected=None):
+    """ Add to df the outliers by density : the samples whose log density is under the threshold,
+    except the selected points for QC3 and QC10 """
 
-    # Labeling according to the chosen threshold
     df['log_kde'] = log_kernel
     df['out_density'] = np.zeros(df.shape[0],)
     df['out_density_min'] = np.zeros(df.shape[0],)
     df.loc[df.log_kde <= threshold, "out_density"] = 1
     df.loc[(df['downward_avg'] <= 350) & (df.log_kde <= threshold), 'out_density_min'] = 1
 
-    # Values of the coefficients tested
-    values_c = list(np.arange(coef_range[0], coef_range[1], step))
-
-    # Name of the coefficient we study
-    coef_name = QC.coefficients[level]
-
     # Adding a constraint for QC3 and QC10
     if QC.name == 'QC3' or QC.name == 'QC10':
-        # We precise that points under a certain limit are not ouliers
-        dic = Coef()
-        dic.__setattr__(coef_name, 0.6)
-
+        # We precise that the selected points are not ouliers
         for el in selected:
             df.loc[(df['temperature'] == el[0]) & (df[QC.vary] == el[1]), 'out_density'] = 0
 
-    # Score initialisation
-    a_scores = []
-    p_scores = []
-    r_scores = []
-    f_scores = []
+
+@profiled()
+def calc_coef(df, log_kernel, QC, threshold, level='level_2', coef_range=[0.0, 1.2], coef_range_min=[0.0, 1.2], step=0.01, step_min=0.1, verbose=True, selected=None,
+              search='grid', tol=1e-4, tol_min=None):
+
+    """ Scores of the coefficients and best coefficient for a density threshold
+    search = 'grid' scores the coefficients of the range with step
+    search = 'adaptive' scans the range with step then refines around the best f1 score until the step is under tol
+    (tol_min for the lower limit, tol by default) : all the coefficients evaluated are in the scores """
+
+    # Labeling according to the chosen threshold
+    label_density(df, log_kernel, QC, threshold, selected)
+
+    # Values of the coefficients tested
+    values_c = list(np.arange(coef_range[0], coef_range[1], step))
+
+    # Name of the coefficient we study
+    coef_name = QC.coefficients[level]
 
     if QC.vary == 'downward_avg':
         coef_name_min = QC.coefficients[level + '_min']
         values_c_min = list(np.arange(coef_range_min[0], coef_range_min[1], step_min))
-        a_scores_min = []
-        p_scores_min = []
-        r_scores_min = []
-        f_scores_min = []
 
     # Verbose
-    if verbose:
+    if verbose and search == 'grid':
         for k in range(len(values_c)):
             print('.', end='')
         print()
 
-    for coef in values_c:
-
+    def evaluate(values):
+        # Scores of the outliers according to the equations and the density
         if verbose:
-            print('-', end='')
-
-        # Generation of coefficient
-        dic = Coef()
-        dic.__setattr__(coef_name, coef)
-
-        # Generation of the outliers according to the equations and the density
-
-        df_lim = df.copy()
-        df_lim['flag'] = QC.calc_lim(df, coef=dic)[3]
-
-        if level == 'level_2':
-            df_lim['out_coef'] = np.zeros(df_lim.shape[0],)
-            df_lim.loc[df_lim.flag == 4, "out_coef"] = 1
-        else:
-            df_lim['out_coef'] = np.zeros(df_lim.shape[0],)
-            df_lim.loc[(df_lim.flag == 2) | (df_lim.flag == 4), "out_coef"] = 1
-
-        a_scores.append(accuracy_score(df['out_density'], df_lim['out_coef']))
-        p_scores.append(precision_score(df['out_density'], df_lim['out_coef'], zero_division=0))
-        r_scores.append(recall_score(df['out_density'], df_lim['out_coef'], zero_division=0))
-        f_scores.append(f1_score(df['out_density'], df_lim['out_coef'], zero_division=0))
-
+            print('-' * len(values), end='')
+        return sweep_scores(df, QC, coef_name, values, _out_flags(level), df['out_density'])
+
+    def evaluate_min(values):
+        return sweep_scores(df, QC, coef_name_min, values, _out_flags(level, lower=True), df['out_density'])
+
+    if search == 'grid':
+        scores = evaluate(values_c)
+        if QC.vary == 'downward_avg':
+            scores_min = evaluate_min(values_c_min)
+    elif search == 'adaptive':
+        values_c, scores = adaptive_search(evaluate, coef_range, step, tol)
+        if QC.vary == 'downward_avg':
+            values_c_min, scores_min = adaptive_search(evaluate_min, coef_range_min, step_min,
+                                                       tol if tol_min is None else tol_min)
+    else:
+        raise ValueError(f"search should be 'grid' or 'adaptive', not {search!r}")
+
+    a_scores, p_scores, r_scores, f_scores = (scores[name] for name in SCORES)
     if QC.vary == 'downward_avg':
-
-        for coef_min in values_c_min:
-
-            # Generation of coefficient
-
-            dic = Coef()
-            dic.__setattr__(coef_name_min, coef_min)
-
-            # Generation of the outliers according to the equations and the density
-
-            df_lim = df.copy()
-            df_lim['flag'] = QC.calc_lim(df, coef=dic)[3]
-
-            if level == 'level_2':
-                df_lim['out_coef'] = np.zeros(df_lim.shape[0],)
-                df_lim.loc[df_lim.flag == 3, "out_coef"] = 1
-            else:
-                df_lim['out_coef'] = np.zeros(df_lim.shape[0],)
-                df_lim.loc[(df_lim.flag == 1) | (df_lim.flag == 3), "out_coef"] = 1
-
-            a_scores_min.append(accuracy_score(df['out_density'],
-                                df_lim['out_coef']))
-            p_scores_min.append(precision_score(df['out_density'], df_lim['out_coef'], zero_division=0))
-            r_scores_min.append(recall_score(df['out_density'], df_lim['out_coef'], zero_division=0))
-            f_scores_min.append(f1_score(df['out_density'], df_lim['out_coef'], zero_division=0))
+        a_scores_min, p_scores_min, r_scores_min, f_scores_min = (scores_min[name] for name in SCORES)
 
     # Creation of the scores dataframe
 
@@ -399,3 +579,101 @@ def calc_coef(df, log_kernel, QC, threshold, level='level_2', coef_range=[0.0, 1
         return df_scores, line_max, df_scores_min, line_max_min
 
     return df_scores, line_max
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+@profiled()
+def calc_coef_exact(df, log_kernel, QC, threshold, level='level_2', coef_range=None, coef_range_min=None, verbose=True, selected=None):
+
+    """ Same as calc_coef but on all the coefficients of the ranges instead of a grid
+    The critical coefficient of each sample is computed and sorted once : the scores are exact, for each
+    interval of coefficients giving the same outliers, and do not depend on a number of coefficients tried """
+
+    # Labeling according to the chosen threshold
+    label_density(df, log_kernel, QC, threshold, selected)
+
+    if coef_range is None:
+        coef_range = QC.coef_range
+
+    # Scores of the upper limit
+    coef_name = QC.coefficients[level]
+    with stage('coef_study.critical_coef'):
+        critical = critical_coef(df, QC, level)
+    df_scores = exact_scores(critical, df['out_density'], coef_name, coef_range)
+    line_max = df_scores.loc[df_scores['f1_score'] == df_scores['f1_score'].max()]
+
+    # Scores of the lower limit
+    if QC.vary == 'downward_avg':
+        if coef_range_min is None:
+            coef_range_min = QC.coef_range_min
+        coef_name_min = QC.coefficients[level + '_min']
+        with stage('coef_study.critical_coef'):
+            critical_min = critical_coef(df, QC, level, lower=True)
+        df_scores_min = exact_scores(critical_min, df['out_density'], coef_name_min, coef_range_min, lower=True)
+        line_max_min = df_scores_min.loc[df_scores_min['f1_score'] == df_scores_min['f1_score'].max()]
+
+    # Print the coefficient
+    if verbose:
+        print('Upper limit')
+        print(line_max)
+
+        if QC.vary == 'downward_avg':
+            print()
+            print('Lower limit')
+            print(line_max_min)
+
+    if QC.vary == 'downward_avg':
+        return df_scores, line_max, df_scores_min, line_max_min
+
+    return df_scores, line_max
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+@profiled()
+def calc_coef_joint(df, log_kernel, QC, threshold, level='level_2', coef_range=None, coef_range_min=None, step=None, step_min=None, verbose=True, selected=None):
+
+    """ Best couple of coefficients of the upper and the lower limit (QC5 and QC10) for a density threshold
+    The outliers of both limits together are scored against the outliers by density, for all the couples of
+    coefficients of the grids (step and step_min, 200 coefficients of the ranges by default)
+    Return the f1 scores (coefficients of the upper limit x coefficients of the lower one), the coefficients
+    of the two grids and the scores of the best couple """
+
+    # Labeling according to the chosen threshold
+    label_density(df, log_kernel, QC, threshold, selected)
+
+    if coef_range is None:
+        coef_range = QC.coef_range
+    if coef_range_min is None:
+        coef_range_min = QC.coef_range_min
+    if step is None:
+        step = (coef_range[1] - coef_range[0]) / 200
+    if step_min is None:
+        step_min = (coef_range_min[1] - coef_range_min[0]) / 200
+    values_c = np.arange(coef_range[0], coef_range[1], step)
+    values_c_min = np.arange(coef_range_min[0], coef_range_min[1], step_min)
+
+    # Critical coefficients of each limit alone : the coefficients of the other limit are set out of the data
+    coef_name = QC.coefficients[level]
+    coef_name_min = QC.coefficients[level + '_min']
+    upper_names = [QC.coefficients['level_1'], QC.coefficients['level_2']]
+    lower_names = [QC.coefficients['level_1_min'], QC.coefficients['level_2_min']]
+    with stage('coef_study.critical_coef'):
+        critical = critical_coef(df, QC, level, others={name: -np.inf for name in lower_names})
+        critical_min = critical_coef(df, QC, level, lower=True, others={name: np.inf for name in upper_names})
+
+    with stage('coef_study.scores'):
+        scores = joint_scores(critical, critical_min, df['out_density'], values_c, values_c_min)
+    f1_scores = scores['f1_score']
+
+    # Getting the couple with the best score, the first one if there are several
+    i, j = np.unravel_index(np.argmax(f1_scores), f1_scores.shape)
+    line_max = pd.DataFrame({coef_name: [values_c[i]], coef_name_min: [values_c_min[j]],
+                             **{name: [scores[name][i, j]] for name in SCORES}})
+
+    if verbose:
+        print('Upper and lower limits')
+        print(line_max)
+
+    return f1_scores, values_c, values_c_min, line_max
@@ -14,6 +14,9 @@ class Station:
         self.LON = loaded_json['STATION']['LON']
         self.ALT = loaded_json['STATION']['ALT']
         self.TZ = loaded_json['STATION']['TZ']
+        self.ZENITH_METHOD = loaded_json['STATION']['ZENITH_METHOD']
+        self.ZENITH_CACHE = loaded_json['STATION']['ZENITH_CACHE']
+        self.ZENITH_CACHE_SIZE = loaded_json['STATION']['ZENITH_CACHE_SIZE']
 
 
 class Coef:
@@ -48,3 +51,28 @@ class Header:
         self.LWDN_NAME = loaded_json['HEADER']['LWDN_NAME']
         self.TA_NAME = loaded_json['HEADER']['TA_NAME']
 
+
+def load_conf(path):
+    """Return the Station and the Coef of a JSON file in the format of qcrad_conf.json
+    Values missing in the file keep their default value"""
+    with open(path, 'r') as f:
+        conf = json.load(f)
+    station, coef = Station(), Coef()
+    for key, value in conf.get('STATION', {}).items():
+        station.__setattr__(key, value)
+    for key, value in conf.get('COEF', {}).items():
+        coef.__setattr__(key, value)
+    return station, coef
+
+
+def write_conf(path, coefs, base=None):
+    """Write a JSON file in the format of qcrad_conf.json : the file base (the default conf if None)
+    with the coefficients of the dict coefs updated"""
+    if base is None:
+        conf = json.loads(json.dumps(loaded_json))
+    else:
+        with open(base, 'r') as f:
+            conf = json.load(f)
+    conf.setdefault('COEF', {}).update({key: float(value) for key, value in coefs.items()})
+    with open(path, 'w') as f:
+        json.dump(conf, f, indent=2)
@@ -0,0 +1,41 @@
+"""
+Module that manages the size of the caches kept on disk
+
+The caches (kde_cache, zenith_cache) store their arrays in .npy files, whose
+modification time is the time of their last use. The least recently used files
+are removed when a cache gets bigger than its size limit. Several processes can
+share a cache : a file removed by another one in the meantime is ignored.
+"""
+
+import os
+
+
+def touch(path):
+    """Mark the file as used now, unless it has been removed in the meantime"""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict(path, max_size):
+    """Remove the least recently used .npy files of the directory path (and of its subdirectories)
+    while they are bigger than max_size bytes"""
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            if name.endswith('.npy'):
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+    size = sum(file[1] for file in files)
+    for _, file_size, file_path in sorted(files):
+        if size <= max_size:
+            break
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        size -= file_size
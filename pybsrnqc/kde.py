@@ -0,0 +1,342 @@
+"""
+Module that computes the density of the samples used to label the outliers
+
+The exact engine is scipy.stats.gaussian_kde evaluated on all the samples,
+which costs O(N²). The binned engine spreads the samples on a regular grid
+(linear binning), convolves the grid with the Gaussian kernel by FFT and
+interpolates the result back to the samples, in O(N + grid size log(grid size)).
+Both engines use the kernel of gaussian_kde for a bandwidth method (scott,
+silverman, a scalar or a callable) : the covariance of the data times the
+squared bandwidth factor.
+
+The exact engine evaluates the samples by chunks in a pool of threads (gaussian_kde
+releases the GIL during the sums), each chunk within a memory ceiling. The density
+of a sample is summed over all the kernels in the same order whatever its chunk,
+so the result is the same as one call of gaussian_kde on all the samples.
+
+The exact engine can also be fitted on a subsample (fit_kde) and evaluated on all
+the samples, in O(N x fit size). The stratified subsample draws the same number
+of samples in each cell of a grid, weighted by the samples they stand for, so
+that the sparse cells (the outliers) keep all their samples, and the bandwidth
+is the one of the whole data.
+
+Error of the binned engine : the linear binning and the interpolation are both
+multilinear interpolations of the kernel, whose second derivative along the
+dimension d is at most K(0) (Σ⁻¹)dd (Σ being the covariance of the kernel). The
+kernel is truncated at tau standard deviations along each dimension, where it is
+under K(0) exp(-tau²/2). So at any sample
+
+    |binned - exact| <= K(0) (Σd spacing_d² (Σ⁻¹)dd / 4 + exp(-tau² / 2))
+
+with K(0) = 1 / (2π sqrt(det Σ)) the height of the kernel (see binned_error_bound).
+
+Error of the tree engine : the samples are split in a kd-tree in the space where
+the kernel is a standard Gaussian. The contribution of a box of samples to a box
+of evaluated samples is taken as the mean of its bounds when they are close
+enough : each sample of the box can then add an error of rtol / N times a lower
+bound of the density, so that the error is at most rtol times the density at any
+sample, in the tails as in the dense areas. The other contributions are exact.
+"""
+
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from scipy import signal, stats
+
+# Engines of kde_computing
+ENGINES = ['exact', 'binned', 'tree']
+
+# Memory of a worker of the exact engine (bytes)
+CHUNK_MEMORY = 2 ** 28
+
+# Minimum number of chunks of the exact engine, for the progress and the balance of the workers
+CHUNKS = 100
+
+# Number of samples the KDE is fitted on with fit_kde
+FIT_SIZE = 20000
+
+# Number of bins along each dimension of the stratified subsample
+BINS = 32
+
+# Number of grid points along each dimension for the binned engine
+GRID_SIZE = 1024
+
+# Standard deviations of the kernel kept by the binned engine
+TAU = 6.
+
+# Relative tolerance of the tree engine
+RTOL = 1e-3
+
+# Maximum number of samples in the leaves of the tree
+LEAF_SIZE = 64
+
+# Number of kernel values computed at once by the tree engine
+BLOCK_SIZE = 2 ** 22
+
+
+def kernel_covariance(X, bw_method=None):
+    """Covariance of the Gaussian kernel of gaussian_kde for the samples X (dimensions x samples)"""
+    return stats.gaussian_kde(X, bw_method=bw_method).covariance
+
+
+def chunk_size(n, d, memory=CHUNK_MEMORY):
+    """Number of samples evaluated at once by a worker of evaluate_kde within memory bytes
+    A call of gaussian_kde on m samples allocates the n kernels and the m samples whitened (with their copies)
+    and the m densities"""
+    free = memory // 8 - 2 * d * n
+    if free < 2 * d + 1:
+        raise ValueError(f'memory should be more than {8 * (2 * d * (n + 1) + 1)} bytes for {n} samples, not {memory}')
+    return free // (2 * d + 1)
+
+
+def evaluate_kde(model, X, jobs=1, memory=CHUNK_MEMORY, progress=None):
+    """Density of a fitted gaussian_kde (model) at the samples X (dimensions x samples)
+    The samples are evaluated by chunks (at least CHUNKS, each one within memory bytes) in a pool of jobs threads,
+    progress(chunks done, chunks) being called after each chunk. The result is the one of a single call"""
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    n = X.shape[1]
+    size = max(1, min(chunk_size(model.n, model.d, memory), -(-n // CHUNKS)))
+    chunks = [slice(start, start + size) for start in range(0, n, size)]
+
+    density = np.empty(n)
+
+    def evaluate(chunk):
+        density[chunk] = model(X[:, chunk])
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(evaluate, chunk) for chunk in chunks]
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            if progress is not None:
+                progress(done, len(chunks))
+    return density
+
+
+def exact_kde(X, bw_method=None, jobs=1, memory=CHUNK_MEMORY, progress=None):
+    """Density of the samples X (dimensions x samples) with gaussian_kde, O(N²), evaluated by chunks in jobs
+    threads (see evaluate_kde)"""
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    return evaluate_kde(stats.gaussian_kde(X, bw_method=bw_method), X, jobs, memory, progress)
+
+
+def _allocation(counts, size):
+    """Number of samples drawn in each bin : the same number in each bin, all the samples of the smaller bins"""
+    take = np.zeros_like(counts)
+    left, bins = size, np.count_nonzero(counts)
+    for k in np.argsort(counts):
+        if counts[k] > 0:
+            take[k] = min(counts[k], left // bins)
+            left, bins = left - take[k], bins - 1
+    return take
+
+
+def subsample(X, fit_size, sampling='stratified', bins=BINS, seed=0):
+    """Indices and weights of fit_size samples of X (dimensions x samples) at most
+    sampling = 'uniform' draws them uniformly without replacement (the weights are None), 'stratified' draws the
+    same number in each cell of a grid of bins along each dimension (all the samples of the cells with fewer ones),
+    so that the tails are kept, each sample weighing the samples of its cell that it stands for"""
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    n = X.shape[1]
+    rng = np.random.default_rng(seed)
+    if sampling == 'uniform':
+        return np.sort(rng.choice(n, size=min(fit_size, n), replace=False)), None
+    if sampling != 'stratified':
+        raise ValueError(f"sampling should be 'stratified' or 'uniform', not {sampling!r}")
+
+    low, high = X.min(axis=1), X.max(axis=1)
+    position = (X - low[:, np.newaxis]) / np.where(high > low, high - low, 1)[:, np.newaxis]
+    cell = np.ravel_multi_index(tuple(np.minimum((position * bins).astype(np.intp), bins - 1)), (bins,) * len(X))
+    counts = np.bincount(cell, minlength=bins ** len(X))
+    take = _allocation(counts, fit_size)
+
+    # random rank of each sample in its cell, the first ones being drawn
+    order = np.lexsort((rng.random(n), cell))
+    rank = np.arange(n) - (np.cumsum(counts) - counts)[cell[order]]
+    index = np.sort(order[rank < take[cell[order]]])
+    return index, counts[cell[index]] / take[cell[index]]
+
+
+def fit_kde(X, bw_method=None, fit_size=FIT_SIZE, sampling='stratified', bins=BINS, seed=0):
+    """gaussian_kde fitted on fit_size samples of X (dimensions x samples) drawn by subsample, to be evaluated
+    on all the samples (see evaluate_kde) or on new ones. The bandwidth factor is the one of all the samples"""
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    model = stats.gaussian_kde(X, bw_method=bw_method)
+    if fit_size is not None and fit_size < X.shape[1]:
+        index, weights = subsample(X, fit_size, sampling, bins, seed)
+        model = stats.gaussian_kde(X[:, index], bw_method=model.factor, weights=weights)
+    # the covariance factor of a scalar bw_method is a lambda, which cannot be pickled with the model
+    model.covariance_factor = functools.partial(float, model.factor)
+    return model
+
+
+def _linear_binning(X, low, spacing, shape):
+    """Grid indices (flat) and weights of the 2^d grid points around each sample"""
+    position = (X - low[:, np.newaxis]) / spacing[:, np.newaxis]
+    cell = np.clip(np.floor(position).astype(np.intp), 0, np.array(shape)[:, np.newaxis] - 2)
+    fraction = position - cell
+    corners = []
+    for corner in itertools.product([0, 1], repeat=len(shape)):
+        corner = np.array(corner)[:, np.newaxis]
+        index = np.ravel_multi_index(tuple(cell + corner), shape)
+        weight = np.prod(np.where(corner == 1, fraction, 1 - fraction), axis=0)
+        corners.append((index, weight))
+    return corners
+
+
+def binned_error_bound(covariance, spacing, tau=TAU):
+    """Bound of the absolute difference between the binned and the exact density at any sample"""
+    covariance = np.atleast_2d(covariance)
+    precision = np.linalg.inv(covariance)
+    peak = 1 / np.sqrt(np.linalg.det(2 * np.pi * covariance))
+    return peak * (np.sum(np.asarray(spacing) ** 2 * np.diag(precision)) / 4 + np.exp(-tau ** 2 / 2))
+
+
+def binned_kde(X, bw_method=None, grid_size=GRID_SIZE, tau=TAU):
+    """Density of the samples X (dimensions x samples) on a grid of grid_size points along each dimension
+    The samples are spread on the grid (linear binning), the grid is convolved with the kernel of gaussian_kde
+    truncated at tau standard deviations (FFT) and the density is interpolated back to the samples
+    Return the density and the bound of its error (see binned_error_bound)"""
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    covariance = kernel_covariance(X, bw_method)
+    sigma = np.sqrt(np.diag(covariance))
+
+    # grid covering the samples
+    low, high = X.min(axis=1), X.max(axis=1)
+    spacing = np.where(high > low, (high - low) / (grid_size - 1), sigma)
+    shape = (grid_size,) * len(X)
+    corners = _linear_binning(X, low, spacing, shape)
+    counts = np.zeros(grid_size ** len(X))
+    for index, weight in corners:
+        counts += np.bincount(index, weights=weight, minlength=len(counts))
+
+    # kernel on the offsets of the grid, up to tau standard deviations (at most the whole grid)
+    half = np.minimum(np.ceil(tau * sigma / spacing), grid_size - 1).astype(int)
+    offsets = np.meshgrid(*[np.arange(-h, h + 1) * s for h, s in zip(half, spacing)], indexing='ij')
+    u = np.stack([offset.ravel() for offset in offsets])
+    precision = np.linalg.inv(covariance)
+    kernel = np.exp(-0.5 * np.sum(u * (precision @ u), axis=0)) / np.sqrt(np.linalg.det(2 * np.pi * covariance))
+
+    grid = signal.fftconvolve(counts.reshape(shape), kernel.reshape(offsets[0].shape), mode='same').ravel()
+    grid /= X.shape[1]
+
+    density = np.zeros(X.shape[1])
+    for index, weight in corners:
+        density += weight * grid[index]
+    return density, binned_error_bound(covariance, spacing, tau)
+
+
+def _kd_tree(W, leaf_size):
+    """Balanced kd-tree of the samples W (samples x dimensions)
+    The node k of a level holds the samples order[bounds[k]:bounds[k + 1]], split in two halves along the widest
+    side of its box for the next level. Return order and, for each level, bounds and the boxes (low, high)"""
+    n = len(W)
+    depth = max(0, int(np.ceil(np.log2(n / leaf_size))))
+    order = np.arange(n)
+    for level in range(depth):
+        bounds = (np.arange(2 ** level + 1) * n) // 2 ** level
+        points = W[order]
+        axis = np.argmax(np.maximum.reduceat(points, bounds[:-1]) - np.minimum.reduceat(points, bounds[:-1]), axis=1)
+        node = np.repeat(np.arange(2 ** level), np.diff(bounds))
+        order = order[np.lexsort((points[np.arange(n), axis[node]], node))]
+
+    points = W[order]
+    levels = []
+    for level in range(depth + 1):
+        bounds = (np.arange(2 ** level + 1) * n) // 2 ** level
+        levels.append((bounds, np.minimum.reduceat(points, bounds[:-1]), np.maximum.reduceat(points, bounds[:-1])))
+    return order, levels
+
+
+def tree_kde(X, bw_method=None, rtol=RTOL, leaf_size=LEAF_SIZE):
+    """Density of the samples X (dimensions x samples) with a relative error under rtol, from a dual kd-tree
+    The kernel is the one of gaussian_kde for bw_method. Going down the tree of the evaluated samples and the
+    tree of the kernels together, the contribution of a box to another one is approximated when its bounds
+    differ by less than 2 rtol / N times the lower bound of the density in the box evaluated, and computed
+    exactly between the leaves otherwise"""
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    covariance = kernel_covariance(X, bw_method)
+    n = X.shape[1]
+
+    # samples in the space where the kernel is exp(-|w|² / 2)
+    W = np.linalg.solve(np.linalg.cholesky(covariance), X).T
+    order, levels = _kd_tree(W, leaf_size)
+
+    # couples of boxes (evaluated q, kernels r) going down the levels
+    q = r = np.zeros(1, dtype=np.intp)
+    approx, approx_low = np.zeros(1), np.zeros(1)
+    for level, (bounds, low, high) in enumerate(levels):
+        nodes = len(bounds) - 1
+        count = np.diff(bounds)
+        gap = np.maximum(0, np.maximum(low[r] - high[q], low[q] - high[r]))
+        far = np.maximum(high[r] - low[q], high[q] - low[r])
+        k_max = np.exp(-0.5 * np.sum(gap ** 2, axis=1))
+        k_min = np.exp(-0.5 * np.sum(far ** 2, axis=1))
+
+        # lower bound of the sum of the kernels in each box evaluated
+        lower_bound = approx_low + np.bincount(q, weights=count[r] * k_min, minlength=nodes)
+        close = k_max - k_min <= 2 * rtol * lower_bound[q] / n
+        approx = approx + np.bincount(q[close], weights=count[r[close]] * (k_max[close] + k_min[close]) / 2,
+                                      minlength=nodes)
+        approx_low = approx_low + np.bincount(q[close], weights=count[r[close]] * k_min[close], minlength=nodes)
+        q, r = q[~close], r[~close]
+
+        if level < len(levels) - 1:
+            # the children of node k are the nodes 2k and 2k + 1 of the next level
+            approx, approx_low = np.repeat(approx, 2), np.repeat(approx_low, 2)
+            q = (2 * q[:, np.newaxis] + np.array([0, 0, 1, 1])).ravel()
+            r = (2 * r[:, np.newaxis] + np.array([0, 1, 0, 1])).ravel()
+
+    # exact sums between the leaves left, as products of augmented vectors centred on the kernel leaf
+    # (a - c).(b - c) - |a - c|² / 2 - |b - c|² / 2 = -|a - b|² / 2, the kernel leaves being padded
+    # by samples of weight exp(-1e300) = 0 and the leaves evaluated by samples whose sums are dropped
+    bounds = levels[-1][0]
+    leaves, size, dim = len(bounds) - 1, np.diff(bounds).max(), W.shape[1]
+    slot = np.arange(n) - np.repeat(bounds[:-1], np.diff(bounds))
+    leaf = np.repeat(np.arange(leaves), np.diff(bounds))
+    centre = (levels[-1][1] + levels[-1][2]) / 2
+    padded_q = np.zeros((leaves, size, dim))
+    padded_q[leaf, slot] = W[order]
+    kernels = np.zeros((leaves, dim + 2, size))
+    kernels[:, -1] = -1e300
+    kernels[leaf, :dim, slot] = W[order] - centre[leaf]
+    kernels[leaf, dim, slot] = 1
+    kernels[leaf, -1, slot] = -0.5 * np.sum(kernels[leaf, :dim, slot] ** 2, axis=1)
+
+    sums = np.zeros(leaves * size)
+    pairs = np.argsort(q, kind='stable')
+    q, r = q[pairs], r[pairs]
+    step = max(1, BLOCK_SIZE // size ** 2)
+    for start in range(0, len(q), step):
+        qb, rb = q[start:start + step], r[start:start + step]
+        evaluated = np.empty((len(qb), size, dim + 2))
+        evaluated[:, :, :dim] = padded_q[qb] - centre[rb][:, np.newaxis]
+        evaluated[:, :, dim] = -0.5 * np.sum(evaluated[:, :, :dim] ** 2, axis=2)
+        evaluated[:, :, -1] = 1
+        exponents = np.matmul(evaluated, kernels[rb])
+        np.exp(exponents, out=exponents)
+        index = (qb[:, np.newaxis] * size + np.arange(size)).ravel()
+        first = index.min()
+        sums[first:index.max() + 1] += np.bincount(index - first, weights=exponents.sum(axis=2).ravel())
+
+    density = np.empty(n)
+    density[order] = (sums.reshape(-1, size)[leaf, slot] + approx[leaf]) / n
+    return density / np.sqrt(np.linalg.det(2 * np.pi * covariance))
+
+
+def density(X, bw_method=None, engine='exact', grid_size=GRID_SIZE, rtol=RTOL, jobs=1, memory=CHUNK_MEMORY,
+            progress=None, fit_size=None, sampling='stratified', seed=0):
+    """Density of the samples X (dimensions x samples) with an engine of ENGINES
+    fit_size = n fits the exact engine on n samples only (see fit_kde), the density being evaluated on all"""
+    if fit_size is not None and engine != 'exact':
+        raise ValueError(f"fit_size can only be used with the exact engine, not {engine!r}")
+    if engine == 'exact' and fit_size is not None:
+        return evaluate_kde(fit_kde(X, bw_method, fit_size, sampling, seed=seed), X, jobs, memory, progress)
+    if engine == 'exact':
+        return exact_kde(X, bw_method, jobs, memory, progress)
+    if engine == 'binned':
+        return binned_kde(X, bw_method, grid_size)[0]
+    if engine == 'tree':
+        return tree_kde(X, bw_method, rtol)
+    raise ValueError(f'engine should be one of {ENGINES}, not {engine!r}')
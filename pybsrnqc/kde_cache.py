@@ -0,0 +1,66 @@
+"""
+Module that keeps the computed densities on disk
+
+The density of the samples of a couple of variables is stored in a .npy file
+named after a hash of the samples (values and shape), of the bandwidth method
+and of the engine with its parameters : the same data gives the same file,
+whatever the file or the session it comes from. The least recently used files
+are removed when the cache gets bigger than its size limit.
+"""
+
+import hashlib
+import os
+import uuid
+
+import numpy as np
+
+from pybsrnqc import disk_cache
+
+
+class KdeCache:
+
+    def __init__(self, path, max_size=1000):
+        """path : directory of the cache
+        max_size : size limit of the whole cache in MB"""
+        self.path = path
+        self.max_size = max_size * 10**6
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(X, bw_method, engine, parameters=()):
+        """Hash of the samples X (dimensions x samples), the bandwidth method and the engine with its parameters"""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        digest = hashlib.sha256()
+        digest.update(repr((X.shape, bw_method, engine, tuple(parameters))).encode())
+        digest.update(X.tobytes())
+        return digest.hexdigest()
+
+    def file_path(self, key):
+        return os.path.join(self.path, f'{key}.npy')
+
+    def get(self, X, bw_method, engine, compute, parameters=()):
+        """Return the density of the samples X (dimensions x samples)
+        compute is called if it is not in the cache yet and returns the density
+        A callable bw_method cannot be hashed by its content : the density is then always computed"""
+        if callable(bw_method):
+            return compute()
+        path = self.file_path(self.key(X, bw_method, engine, parameters))
+        try:
+            density = np.load(path)
+        except FileNotFoundError:
+            # not computed yet, or evicted by another process
+            pass
+        else:
+            disk_cache.touch(path)
+            return density
+        density = np.asarray(compute(), dtype=np.float64)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, density)
+        os.replace(tmp_path, path)
+        self.evict()
+        return density
+
+    def evict(self):
+        """Remove the least recently used files while the cache is bigger than its size limit"""
+        disk_cache.evict(self.path, self.max_size)
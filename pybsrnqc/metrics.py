@@ -0,0 +1,62 @@
+"""
+Module that scores binary predictions of outliers
+
+The confusion counts (TP, FP, FN, TN) of a batch of predictions are computed in
+one pass with an integer bincount, and all the scores are derived from them.
+The scores are the ones of sklearn.metrics with zero_division=0.
+"""
+
+import numpy as np
+
+
+def confusion(y_true, y_pred):
+    """ True positives, false positives, false negatives and true negatives of the predictions
+    y_pred is one prediction (1D) or a batch of predictions, one per line (2D) : the counts are then arrays
+    A value equal to 1 (or True) is an outlier """
+
+    y_true = np.asarray(y_true) == 1
+    y_pred = np.asarray(y_pred) == 1
+    batch = np.atleast_2d(y_pred)
+
+    # code of each sample 0: TN, 1: FP, 2: FN, 3: TP, shifted by 4 for each prediction of the batch
+    codes = 2 * y_true.astype(np.intp) + batch + 4 * np.arange(batch.shape[0])[:, np.newaxis]
+    counts = np.bincount(codes.ravel(), minlength=4 * batch.shape[0]).reshape(-1, 4)
+    tn, fp, fn, tp = counts.T
+
+    if y_pred.ndim == 1:
+        return int(tp[0]), int(fp[0]), int(fn[0]), int(tn[0])
+    return tp, fp, fn, tn
+
+
+def matthews_corrcoef(tp, fp, fn, tn):
+    """ Matthews correlation coefficient from the counts, 0 when a class is missing """
+
+    tp, fp, fn, tn = (np.asarray(count, dtype=np.float64) for count in (tp, fp, fn, tn))
+    n = (tn + fn) + (fp + tp)
+    cov_ytyp = (tp + tn) * n - ((tn + fp) * (tn + fn) + (fn + tp) * (fp + tp))
+    cov_ypyp = n ** 2 - ((tn + fn) * (tn + fn) + (fp + tp) * (fp + tp))
+    cov_ytyt = n ** 2 - ((tn + fp) * (tn + fp) + (fn + tp) * (fn + tp))
+    cov_ypyp_ytyt = cov_ypyp * cov_ytyt
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(cov_ypyp_ytyt == 0, 0., cov_ytyp / np.sqrt(cov_ypyp_ytyt))
+
+
+def scores(tp, fp, fn, tn):
+    """ Accuracy, precision, recall, f1 and Matthews correlation coefficient from the counts
+    Return a dict of arrays (or floats for one prediction) named as the sklearn functions """
+
+    tp, fp, fn, tn = (np.asarray(count, dtype=np.int64) for count in (tp, fp, fn, tn))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = {'accuracy_score': (tp + tn) / (tp + fp + fn + tn),
+                  'precision_score': np.where(tp + fp > 0, tp / (tp + fp), 0.),
+                  'recall_score': np.where(tp + fn > 0, tp / (tp + fn), 0.),
+                  'f1_score': np.where(2 * tp + fp + fn > 0, 2. * tp / ((tp + fn) + (tp + fp)), 0.),
+                  'matthews_corrcoef': matthews_corrcoef(tp, fp, fn, tn)}
+    if tp.ndim == 0:
+        return {name: float(score) for name, score in result.items()}
+    return result
+
+
+def batch_scores(y_true, y_pred):
+    """ Scores of a prediction or of a batch of predictions (one per line) """
+    return scores(*confusion(y_true, y_pred))
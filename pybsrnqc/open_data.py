@@ -7,7 +7,8 @@ import os
 import pandas as pd
 
 from pybsrnqc.config import Station
-from pybsrnqc.utils import getZenith
+from pybsrnqc.profiling import profiled, stage
+from pybsrnqc.utils import findRawFiles, getStationZenith
 
 
 # -----------------------------------------------------------------------------------------------------------------
@@ -15,17 +16,17 @@ from pybsrnqc.utils import getZenith
 # Récupération de toutes les données
 
 
+@profiled()
 def open_all(path='./dataset', period=None, select_day=False, select_zenith=True, station: Station = Station()):
     """ Open as a dataframe the raw data in a repository
     select_day = True means it doesn't take night hours
     select_zenith = True means it computes the SZA in the dataframe
-    You have to choose the period of month you want """
+    You have to choose the period of month you want, all the YYYYMM_raw.csv files of the directory by default
+    (not the files written by the QC) """
     path = path + '/'
     if period is None:
 
-        dirs = os.listdir(path)
-        if '.keep' in dirs:
-            dirs.remove('.keep')
+        dirs = [os.path.basename(filepath) for filepath in findRawFiles(path)]
 
     else:
 
@@ -56,18 +57,19 @@ def open_all(path='./dataset', period=None, select_day=False, select_zenith=True
 
     les_df = []
 
-    for i in range(len(dirs)):
-        df = pd.read_csv(path + dirs[i], encoding='latin-1', sep=',')
-        les_df.append(df)
+    with stage('open_data.read_csv'):
+        for i in range(len(dirs)):
+            df = pd.read_csv(path + dirs[i], encoding='latin-1', sep=',')
+            les_df.append(df)
 
-    fusion_df = pd.concat(les_df)
+        fusion_df = pd.concat(les_df)
 
     df_fus = fusion_df.copy()
 
     # Zenith computation
 
     timestamp_list = df_fus.timestamp.to_list()
-    zenith_serie = getZenith(timestamp_list, station.LAT, station.LON, station.ALT)
+    zenith_serie = getStationZenith(timestamp_list, station)
     df_fus['SZA'] = list(zenith_serie)
 
     if select_zenith:
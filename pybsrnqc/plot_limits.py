@@ -9,9 +9,11 @@ import numpy as np
 import pandas as pd
 from matplotlib.path import Path
 from matplotlib.widgets import LassoSelector
-from scipy import stats
 
+from pybsrnqc import kde
 from pybsrnqc.config import Coef
+from pybsrnqc.kde_cache import KdeCache
+from pybsrnqc.profiling import profiled, stage
 
 # -----------------------------------------------------------------------------------------------------------
 # Plots of the BSRN limits on datasets
@@ -23,39 +25,14 @@ def limit_plot(df, QC, coef: Coef, save: bool = False, level='all', display: boo
     """ Function plotting the limit curves and the dataset points of a
         dataframe"""
 
-    df = df[['timestamp', QC.varx, QC.vary]]
+    val1_var = df[QC.varx].to_numpy(dtype=float)
+    val2_var = df[QC.vary].to_numpy(dtype=float)
 
-    X_val1 = np.array(df[QC.varx])
-    X_val2 = np.array(df[QC.vary])
-
-    lim_l1 = []
-    lim_l2 = []
-    lim_bsrn = []
-
-    lim_l1_min = []
-    lim_l2_min = []
-    lim_bsrn_min = []
-
-    val1_var = list(X_val1)
-    val2_var = list(X_val2)
-
-    for VAL1, VAL2 in zip(X_val1, X_val2):
-
-        if QC.vary == 'downward_avg':
-
-            l1, l2, l_bsrn, l1_min, l2_min, l_bsrn_min = QC.f(VAL2, VAL1, coef)
-
-            lim_l1_min.append(l1_min)
-            lim_l2_min.append(l2_min)
-            lim_bsrn_min.append(l_bsrn_min)
-
-        else:
-
-            l1, l2, l_bsrn = QC.f(VAL2, VAL1, coef)
-
-        lim_l1.append(l1)
-        lim_l2.append(l2)
-        lim_bsrn.append(l_bsrn)
+    # Limits of all the samples at once
+    if QC.vary == 'downward_avg':
+        lim_l1, lim_l2, lim_bsrn, lim_l1_min, lim_l2_min, lim_bsrn_min = QC.f(val2_var, val1_var, coef)
+    else:
+        lim_l1, lim_l2, lim_bsrn = QC.f(val2_var, val1_var, coef)
 
     if fig:
         plt.figure(figsize=(20, 14))
@@ -176,15 +153,51 @@ def hist_data(df, QC, dimension='3D'):
 # KDE computation and plotting for our dataset
 
 
+@profiled()
 def kde_computing(df, QC, display=True, coef: Coef = None, limits=False, level='All',
-                  log_form=True, save='KDE_result', select=False, bw_sel=None):
+                  log_form=True, save='KDE_result', select=False, bw_sel=None, engine='exact', grid_size=kde.GRID_SIZE,
+                  rtol=kde.RTOL, jobs=1, chunk_memory=kde.CHUNK_MEMORY, cache=None, cache_size=1000,
+                  fit_size=None, sampling='stratified', model=None, progress=False):
+
+    """ Density of the samples along (QC.varx, QC.vary)
+    engine = 'exact' evaluates gaussian_kde on all the samples (O(N²)), 'binned' convolves the samples binned
+    on a grid of grid_size x grid_size points with the same kernel (error bounded, see the kde module),
+    'tree' sums the same kernel with a dual kd-tree, with a relative error under rtol at every sample
+    The exact engine evaluates the samples by chunks in jobs threads, each one within chunk_memory bytes,
+    with the same result as a single evaluation
+    cache = path of a directory means the density is kept there and only computed for new data, bandwidth or
+    engine (see KdeCache), cache_size being the size limit of the cache in MB
+    fit_size = n fits the exact KDE on n samples drawn by sampling ('stratified' along (varx, vary) or 'uniform',
+    see kde.fit_kde) and evaluates it on all the samples. model = a KDE fitted by kde.fit_kde (on other data)
+    evaluates it on the samples, without cache
+    progress = True prints the share of the exact KDE done, every tenth of the chunks """
 
     # Get the data
     X = np.array(df[[QC.vary, QC.varx]]).T
     # Kernel calculation
-    print('Computing kde - It can take some times')
-
-    kernel = stats.gaussian_kde(X, bw_method=bw_sel)(X)
+    def print_progress(done, chunks):
+        if done * 10 // chunks != (done - 1) * 10 // chunks:
+            print(f'[{done}/{chunks}] chunks of the KDE', flush=True)
+
+    progress = print_progress if progress else None
+
+    def compute():
+        if engine == 'exact':
+            print('Computing kde - It can take some times')
+        with stage(f'plot_limits.{engine}_kde'):
+            return kde.density(X, bw_method=bw_sel, engine=engine, grid_size=grid_size, rtol=rtol, jobs=jobs,
+                               memory=chunk_memory, progress=progress, fit_size=fit_size, sampling=sampling)
+
+    if model is not None:
+        with stage('plot_limits.fitted_kde'):
+            kernel = kde.evaluate_kde(model, X, jobs, chunk_memory, progress)
+    elif cache is None:
+        kernel = compute()
+    else:
+        parameters = {'binned': (grid_size,), 'tree': (rtol,)}.get(engine, ())
+        if fit_size is not None:
+            parameters += (fit_size, sampling)
+        kernel = KdeCache(cache, cache_size).get(X, bw_sel, engine, compute, parameters)
     kernel_log = np.log(kernel)
 
     # Plot
@@ -0,0 +1,122 @@
+"""
+Module that measures the time and the memory spent in the main stages
+
+The stages (CSV reading, zenith, QC, KDE, coefficient loops...) are marked in
+the package with the stage context manager or the profiled decorator. Nothing
+is recorded until enable() is called : a disabled stage only checks a flag.
+Each stage records its number of calls, its total wall time and, when the
+memory is traced (tracemalloc), the peak of memory allocated during a call.
+Only the stages run in the current process are recorded.
+"""
+
+import functools
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_enabled = os.environ.get('PYBSRNQC_PROFILE', '') not in ('', '0')
+_memory = False
+_registry = {}
+_stack = []
+
+
+def enable(memory=False):
+    """Start recording the stages
+    memory = True traces the allocations with tracemalloc, which slows down the code"""
+    global _enabled, _memory
+    _enabled = True
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """Stop recording the stages, the records are kept"""
+    global _enabled, _memory
+    _enabled = False
+    if _memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _memory = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Remove all the records"""
+    _registry.clear()
+
+
+@contextmanager
+def stage(name):
+    """Record the time (and memory) of the code in the with block under the stage name"""
+    if not _enabled:
+        yield
+        return
+    memory = _memory and tracemalloc.is_tracing()
+    if memory:
+        # the peak is reset for this stage, the enclosing stage keeps the peak reached so far
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack:
+            _stack[-1]['peak'] = max(_stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        frame = {'start': current, 'peak': current}
+        _stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        record = _registry.setdefault(name, {'calls': 0, 'seconds': 0., 'peak_memory': None})
+        record['calls'] += 1
+        record['seconds'] += seconds
+        if memory:
+            frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            _stack.pop()
+            if _stack:
+                _stack[-1]['peak'] = max(_stack[-1]['peak'], frame['peak'])
+            record['peak_memory'] = max(record['peak_memory'] or 0, frame['peak'] - frame['start'])
+
+
+def profiled(name=None):
+    """Decorator recording each call of a function as a stage (named module.function by default)"""
+    def decorator(function):
+        stage_name = name or f'{function.__module__.split(".")[-1]}.{function.__name__}'
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report():
+    """Return the records as a dict : stage name -> calls, seconds, mean_seconds, peak_memory (bytes)"""
+    return {name: {'calls': record['calls'],
+                   'seconds': record['seconds'],
+                   'mean_seconds': record['seconds'] / record['calls'],
+                   'peak_memory': record['peak_memory']}
+            for name, record in _registry.items()}
+
+
+def save_report(path):
+    """Write the records in a JSON file"""
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+
+
+def print_report():
+    """Print the records as a table, the longest stages first"""
+    records = sorted(report().items(), key=lambda item: -item[1]['seconds'])
+    width = max([len(name) for name, _ in records] + [5])
+    print(f'{"stage":<{width}} {"calls":>8} {"seconds":>10} {"mean (s)":>10} {"peak (MB)":>10}')
+    for name, record in records:
+        peak = '' if record['peak_memory'] is None else f'{record["peak_memory"] / 1e6:.1f}'
+        print(f'{name:<{width}} {record["calls"]:>8} {record["seconds"]:>10.3f} '
+              f'{record["mean_seconds"]:>10.4f} {peak:>10}')
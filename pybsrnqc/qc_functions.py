@@ -2,58 +2,33 @@
 Module that provides the QC class with their assiocated functions and labeling
 """
 
-import math
-
 import numpy as np
 
 import pybsrnqc.qcrad as qcr
+import pybsrnqc.qcrad_vectorized as vqcr
 from pybsrnqc.config import Coef
 
 
 def gen_calc_lim(self, df, coef: Coef):
-    """ Computation of the limits and the labels of a dataframe"""
-
-    df = df[['timestamp', self.varx, self.vary]]
-
-    X_val1 = np.array(df[self.varx])
-    X_val2 = np.array(df[self.vary])
-
-    lim_l1 = []
-    lim_l2 = []
-    lim_bsrn = []
-
-    lim_l1_min = []
-    lim_l2_min = []
-    lim_bsrn_min = []
-
-    labels = []
-
-    for VAL1, VAL2 in zip(X_val1, X_val2):
-
-        if self.vary == 'downward_avg':
-
-            l1, l2, l_bsrn, l1_min, l2_min, l_bsrn_min = self.f(VAL2, VAL1, coef)
-
-            lim_l1_min.append(l1_min)
-            lim_l2_min.append(l2_min)
-            lim_bsrn_min.append(l_bsrn_min)
-
-        else:
-
-            l1, l2, l_bsrn = self.f(VAL2, VAL1, coef)
+    """ Computation of the limits and the labels of a dataframe, as arrays"""
 
-        label = self.lab(VAL2, VAL1, coef)
+    X_val1 = df[self.varx].to_numpy(dtype=float)
+    X_val2 = df[self.vary].to_numpy(dtype=float)
 
-        lim_l1.append(l1)
-        lim_l2.append(l2)
-        lim_bsrn.append(l_bsrn)
-        labels.append(label)
+    labels = self.lab(X_val2, X_val1, coef)
 
     if self.vary == 'downward_avg':
+        lim_l1, lim_l2, lim_bsrn, lim_l1_min, lim_l2_min, lim_bsrn_min = self.f(X_val2, X_val1, coef)
         return lim_l1, lim_l2, lim_bsrn, labels, lim_l1_min, lim_l2_min, lim_bsrn_min
     else:
+        lim_l1, lim_l2, lim_bsrn = self.f(X_val2, X_val1, coef)
         return lim_l1, lim_l2, lim_bsrn, labels
 
+
+def _full(sample, value):
+    """ Limit that does not depend on the sample, with the shape of the sample """
+    return np.full(np.shape(sample), value, dtype=float)
+
 # Definition of the QC class
 
 
@@ -70,17 +45,26 @@ class QC1:
 
     @staticmethod
     def f(GSW, SZA, coef: Coef):
-        ''' Return the 2 main variables, the 1rst level limit, the 2nd level limit and the physical limit for a sample'''
+        ''' Return the 1rst level limit, the 2nd level limit and the physical limit for a sample or arrays of samples'''
 
-        l1 = qcr.REF.SOLAR_CONSTANT * coef.C1 * math.pow(math.cos(math.radians(SZA)), 1.2) + 50
-        l2 = qcr.REF.SOLAR_CONSTANT * coef.D1 * math.pow(math.cos(math.radians(SZA)), 1.2) + 55
-        l_bsrn = qcr.REF.SOLAR_CONSTANT * 1.5 * math.pow(math.cos(math.radians(SZA)), 1.2) + 100
+        cos_pow = vqcr.cos_pow(SZA, 1.2)
+        l1 = qcr.REF.SOLAR_CONSTANT * coef.C1 * cos_pow + 50
+        l2 = qcr.REF.SOLAR_CONSTANT * coef.D1 * cos_pow + 55
+        l_bsrn = qcr.REF.SOLAR_CONSTANT * 1.5 * cos_pow + 100
 
         return l1, l2, l_bsrn
 
     @staticmethod
     def lab(GSW, SZA, coef: Coef):
-        return qcr.QC1(GSW, SZA, coef)
+        ''' Labels of a sample or of arrays of samples, the coefficients can be arrays too (see qcrad_vectorized)'''
+        return vqcr.QC1(GSW, SZA, coef)
+
+    @staticmethod
+    def critical(GSW, SZA, coef_name):
+        ''' Value of the coefficient coef_name for which the limit is equal to the sample (closed form)'''
+        offset = {'C1': 50, 'D1': 55}[coef_name]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (np.asarray(GSW) - offset) / (qcr.REF.SOLAR_CONSTANT * np.power(np.cos(np.radians(SZA)), 1.2))
 
     def calc_lim(self, df, coef: Coef):
         return gen_calc_lim(self, df, coef)
@@ -99,17 +83,26 @@ class QC2:
 
     @staticmethod
     def f(Dif, SZA, coef: Coef):
-        ''' Return the 2 main variables, the 1rst level limit, the 2nd level limit and the physical limit for a sample'''
+        ''' Return the 1rst level limit, the 2nd level limit and the physical limit for a sample or arrays of samples'''
 
-        l1 = qcr.REF.SOLAR_CONSTANT * coef.C2 * math.pow(math.cos(math.radians(SZA)), 1.2) + 30
-        l2 = qcr.REF.SOLAR_CONSTANT * coef.D2 * math.pow(math.cos(math.radians(SZA)), 1.2) + 35
-        l_bsrn = qcr.REF.SOLAR_CONSTANT * 0.95 * math.pow(math.cos(math.radians(SZA)), 1.2) + 50
+        cos_pow = vqcr.cos_pow(SZA, 1.2)
+        l1 = qcr.REF.SOLAR_CONSTANT * coef.C2 * cos_pow + 30
+        l2 = qcr.REF.SOLAR_CONSTANT * coef.D2 * cos_pow + 35
+        l_bsrn = qcr.REF.SOLAR_CONSTANT * 0.95 * cos_pow + 50
 
         return l1, l2, l_bsrn
 
     @staticmethod
     def lab(Dif, SZA, coef: Coef):
-        return qcr.QC2(Dif, SZA, coef)
+        ''' Labels of a sample or of arrays of samples, the coefficients can be arrays too (see qcrad_vectorized)'''
+        return vqcr.QC2(Dif, SZA, coef)
+
+    @staticmethod
+    def critical(Dif, SZA, coef_name):
+        ''' Value of the coefficient coef_name for which the limit is equal to the sample (closed form)'''
+        offset = {'C2': 30, 'D2': 35}[coef_name]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (np.asarray(Dif) - offset) / (qcr.REF.SOLAR_CONSTANT * np.power(np.cos(np.radians(SZA)), 1.2))
 
     def calc_lim(self, df, coef: Coef):
         return gen_calc_lim(self, df, coef)
@@ -128,17 +121,26 @@ class QC3:
 
     @staticmethod
     def f(DirN, SZA, coef: Coef):
-        ''' Return the 2 main variables, the 1rst level limit, the 2nd level limit and the physical limit for a sample'''
+        ''' Return the 1rst level limit, the 2nd level limit and the physical limit for a sample or arrays of samples'''
 
-        l1 = qcr.REF.SOLAR_CONSTANT * coef.C3 * math.pow(math.cos(math.radians(SZA)), 0.2) + 10
-        l2 = qcr.REF.SOLAR_CONSTANT * coef.D3 * math.pow(math.cos(math.radians(SZA)), 0.2) + 15
-        l_bsrn = qcr.REF.SOLAR_CONSTANT
+        cos_pow = vqcr.cos_pow(SZA, 0.2)
+        l1 = qcr.REF.SOLAR_CONSTANT * coef.C3 * cos_pow + 10
+        l2 = qcr.REF.SOLAR_CONSTANT * coef.D3 * cos_pow + 15
+        l_bsrn = _full(SZA, qcr.REF.SOLAR_CONSTANT)
 
         return l1, l2, l_bsrn
 
     @staticmethod
     def lab(DirN, SZA, coef: Coef):
-        return qcr.QC3(DirN, SZA, coef)
+        ''' Labels of a sample or of arrays of samples, the coefficients can be arrays too (see qcrad_vectorized)'''
+        return vqcr.QC3(DirN, SZA, coef)
+
+    @staticmethod
+    def critical(DirN, SZA, coef_name):
+        ''' Value of the coefficient coef_name for which the limit is equal to the sample (closed form)'''
+        offset = {'C3': 10, 'D3': 15}[coef_name]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (np.asarray(DirN) - offset) / (qcr.REF.SOLAR_CONSTANT * np.power(np.cos(np.radians(SZA)), 0.2))
 
     def calc_lim(self, df, coef: Coef):
         return gen_calc_lim(self, df, coef)
@@ -158,21 +160,27 @@ class QC5:
 
     @staticmethod
     def f(LWdn, SZA, coef: Coef):
-        ''' Return the 2 main variables, the 1rst level limit, the 2nd level limit and the physical limit for a sample'''
+        ''' Return the upper limits (1rst level, 2nd level, physical) then the lower ones for a sample or arrays of samples'''
 
-        l1_max = coef.C6
-        l2_max = coef.D6
-        l_bsrn_max = 700
+        l1_max = _full(LWdn, coef.C6)
+        l2_max = _full(LWdn, coef.D6)
+        l_bsrn_max = _full(LWdn, 700)
 
-        l1_min = coef.C5
-        l2_min = coef.D5
-        l_bsrn_min = 40
+        l1_min = _full(LWdn, coef.C5)
+        l2_min = _full(LWdn, coef.D5)
+        l_bsrn_min = _full(LWdn, 40)
 
         return l1_max, l2_max, l_bsrn_max, l1_min, l2_min, l_bsrn_min
 
     @staticmethod
     def lab(LWdn, SZA, coef: Coef):
-        return qcr.QC5(LWdn, coef)
+        ''' Labels of a sample or of arrays of samples, the coefficients can be arrays too (see qcrad_vectorized)'''
+        return vqcr.QC5(LWdn, coef)
+
+    @staticmethod
+    def critical(LWdn, SZA, coef_name):
+        ''' Value of the coefficient coef_name for which the limit is equal to the sample (closed form)'''
+        return np.asarray(LWdn, dtype=float)
 
     def calc_lim(self, df, coef: Coef):
         return gen_calc_lim(self, df, coef)
@@ -192,21 +200,32 @@ class QC10:
 
     @staticmethod
     def f(LWdn, Ta, coef: Coef):
-        ''' Return the 2 main variables, the 1rst level limit, the 2nd level limit and the physical limit for a sample'''
+        ''' Return the upper limits (1rst level, 2nd level, physical) then the lower ones for a sample or arrays of samples'''
 
-        l1_max = qcr.REF.BOLTZMANN * math.pow(Ta + 273.15, 4) + coef.C12
-        l2_max = qcr.REF.BOLTZMANN * math.pow(Ta + 273.15, 4) + coef.D12
-        l_bsrn_max = 700
+        Ta = np.asarray(Ta, dtype=float)
+        l1_max = qcr.REF.BOLTZMANN * np.float_power(Ta + 273.15, 4) + coef.C12
+        l2_max = qcr.REF.BOLTZMANN * np.float_power(Ta + 273.15, 4) + coef.D12
+        l_bsrn_max = _full(Ta, 700)
 
-        l1_min = coef.C11 * qcr.REF.BOLTZMANN * math.pow(Ta + 274.15, 4)
-        l2_min = coef.D11 * qcr.REF.BOLTZMANN * math.pow(Ta + 274.15, 4)
-        l_bsrn_min = 40
+        l1_min = coef.C11 * qcr.REF.BOLTZMANN * np.float_power(Ta + 274.15, 4)
+        l2_min = coef.D11 * qcr.REF.BOLTZMANN * np.float_power(Ta + 274.15, 4)
+        l_bsrn_min = _full(Ta, 40)
 
         return l1_max, l2_max, l_bsrn_max, l1_min, l2_min, l_bsrn_min
 
     @staticmethod
     def lab(LWdn, Ta, coef: Coef):
-        return qcr.QC10(LWdn, Ta + 273.15, coef)
+        ''' Labels of a sample or of arrays of samples, the coefficients can be arrays too (see qcrad_vectorized)'''
+        return vqcr.QC10(LWdn, np.asarray(Ta) + 273.15, coef)
+
+    @staticmethod
+    def critical(LWdn, Ta, coef_name):
+        ''' Value of the coefficient coef_name for which the limit is equal to the sample (closed form)'''
+        sigma_t4 = qcr.REF.BOLTZMANN * np.power(np.asarray(Ta) + 273.15, 4)
+        if coef_name in {'C12', 'D12'}:
+            return np.asarray(LWdn) - sigma_t4
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.asarray(LWdn) / sigma_t4
 
     def calc_lim(self, df, coef: Coef):
         return gen_calc_lim(self, df, coef)
@@ -0,0 +1,73 @@
+"""
+Module that saves the QC results in a compact binary file
+
+The aqc and qcrad dataframes of a raw file are stored in one .npz file :
+the timestamps as seconds since epoch, the QC flags as int8 columns and the
+aqc columns, which only hold 0/1 (or NaN/1), as packed bits.
+"""
+
+import numpy as np
+import pandas as pd
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _format_time(seconds):
+    """Timestamps in the format of the raw files from seconds since epoch"""
+    text = np.datetime_as_string(seconds.astype('datetime64[s]'), unit='s')
+    return np.char.replace(text, 'T', ' ').astype(object)
+
+
+def save_qc(path, df_aqc: pd.DataFrame, df_qcrad: pd.DataFrame):
+    """Save the aqc and qcrad dataframes in a .npz file"""
+    timestamps = df_qcrad['timestamp'].to_numpy(dtype=object)
+    arrays = {}
+    # timestamps as seconds since epoch, or as text if they are not in the usual format
+    seconds = pd.to_datetime(timestamps, format=TIMESTAMP_FORMAT, errors='coerce')
+    seconds = seconds.values.astype('datetime64[s]').astype(np.int64)
+    if len(timestamps) > 0 and (_format_time(seconds) == timestamps).all():
+        arrays['time'] = seconds
+    else:
+        arrays['timestamp'] = timestamps.astype(str)
+    # QC flags as int8
+    qcrad_columns = [name for name in df_qcrad.columns if name != 'timestamp']
+    arrays['qcrad_columns'] = np.array(qcrad_columns)
+    arrays['qcrad'] = df_qcrad[qcrad_columns].to_numpy(dtype=np.int8)
+    # aqc masks as bits, the columns added to the raw ones hold NaN instead of 0
+    aqc_columns = list(df_aqc.columns)
+    masks = [np.zeros(len(df_aqc), dtype=bool) if name == 'timestamp' else df_aqc[name].to_numpy() == 1
+             for name in aqc_columns]
+    arrays['aqc_columns'] = np.array(aqc_columns)
+    arrays['aqc_float'] = np.array([df_aqc[name].dtype.kind == 'f' for name in aqc_columns], dtype=bool)
+    arrays['aqc'] = np.packbits(np.array(masks, dtype=bool).reshape(len(aqc_columns), len(df_aqc)), axis=1)
+    arrays['rows'] = np.array(len(df_aqc))
+    np.savez_compressed(path, **arrays)
+
+
+def load_qc(path, time_index=False):
+    """Load the aqc and qcrad dataframes saved by save_qc
+    time_index = False means the dataframes are the ones saved, with their timestamp column
+    time_index = True means the timestamp column is replaced by a DatetimeIndex, which is faster"""
+    with np.load(path) as data:
+        rows = int(data['rows'])
+        index = None
+        if 'time' not in data:
+            timestamps = data['timestamp'].astype(object)
+        elif time_index:
+            index = pd.DatetimeIndex(data['time'].astype('datetime64[s]'), name='timestamp')
+        else:
+            timestamps = _format_time(data['time'])
+        qcrad = {} if index is not None else {'timestamp': timestamps}
+        for i, name in enumerate(data['qcrad_columns'].tolist()):
+            qcrad[name] = data['qcrad'][:, i]
+        masks = np.unpackbits(data['aqc'], axis=1, count=rows).astype(bool)
+        aqc = {}
+        for name, is_float, mask in zip(data['aqc_columns'].tolist(), data['aqc_float'], masks):
+            if name == 'timestamp':
+                if index is None:
+                    aqc[name] = timestamps
+            elif is_float:
+                aqc[name] = np.where(mask, 1., np.nan)
+            else:
+                aqc[name] = mask.astype(np.int64)
+    return pd.DataFrame(aqc, index=index), pd.DataFrame(qcrad, index=index)
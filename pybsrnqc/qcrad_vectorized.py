@@ -0,0 +1,256 @@
+"""
+Module that provides the qcrad tests on whole arrays
+
+Each function mirrors the scalar test of the same name in qcrad, which stays
+the reference implementation : the flags and their priority are identical.
+Inputs are array-like (they are broadcast together), NaN stands for a missing
+value (None in qcrad) and the result is an int8 array of flags.
+"""
+
+import numpy as np
+
+from pybsrnqc.config import Coef
+from pybsrnqc.qcrad import REF
+
+default_coef = Coef()
+
+
+def _as_array(value):
+    """Convert an input to a float array, None becoming NaN"""
+    return np.asarray(value, dtype=float)
+
+
+def _select(conditions, flags, default=0):
+    """Return the flag of the first condition verified, as in the if chains of qcrad"""
+    return np.select(conditions, flags, default=default).astype(np.int8)
+
+
+def cos_pow(SZA, exponent):
+    """cos(SZA)^exponent, NaN where the SZA is outside [0, 90] (not used there by the tests)
+    float_power gives the same floats as math.pow in qcrad, np.power can differ from it by one ulp"""
+    with np.errstate(invalid='ignore'):
+        return np.float_power(np.cos(np.radians(_as_array(SZA))), exponent)
+
+
+def _in_range(SZA):
+    """SZA between 0 and 90 degrees, where the float exponent can be computed"""
+    return (SZA >= 0) & (SZA <= 90)
+
+
+''' *********** QC1-QC6 (GSW, Diffuse SW, Direct SW, SWup, LWdn and LWup basic limits tests) *********** '''
+
+
+def QC1(GSW, SZA, coef: Coef = default_coef):
+    """GSW [basic limits tests]"""
+    GSW, SZA = _as_array(GSW), _as_array(SZA)
+    cos_pow_sza = cos_pow(SZA, 1.2)
+    return _select([np.isnan(GSW),
+                    GSW < -4,
+                    GSW < -2,
+                    ~_in_range(SZA),
+                    GSW > (REF.SOLAR_CONSTANT * 1.5 * cos_pow_sza) + 100,
+                    GSW > (REF.SOLAR_CONSTANT * coef.D1 * cos_pow_sza) + 55,
+                    GSW > (REF.SOLAR_CONSTANT * coef.C1 * cos_pow_sza) + 50],
+                   [-1, 5, 3, -1, 6, 4, 2])
+
+
+def QC2(Dif, SZA, coef: Coef = default_coef):
+    """Diffuse SW [basic limits tests]"""
+    Dif, SZA = _as_array(Dif), _as_array(SZA)
+    cos_pow_sza = cos_pow(SZA, 1.2)
+    return _select([np.isnan(Dif),
+                    Dif < -4,
+                    Dif < -2,
+                    ~_in_range(SZA),
+                    Dif > (REF.SOLAR_CONSTANT * 0.95 * cos_pow_sza) + 50,
+                    Dif > (REF.SOLAR_CONSTANT * coef.D2 * cos_pow_sza) + 35,
+                    Dif > (REF.SOLAR_CONSTANT * coef.C2 * cos_pow_sza) + 30],
+                   [-1, 5, 3, -1, 6, 4, 2])
+
+
+def QC3(DirN, SZA, coef: Coef = default_coef):
+    """Direct Normal SW  [basic limits tests]"""
+    DirN, SZA = _as_array(DirN), _as_array(SZA)
+    cos_pow_sza = cos_pow(SZA, 0.2)
+    return _select([np.isnan(DirN),
+                    DirN < -4,
+                    DirN < -2,
+                    DirN > REF.SOLAR_CONSTANT,
+                    ~_in_range(SZA),
+                    DirN > (REF.SOLAR_CONSTANT * coef.D3 * cos_pow_sza) + 15,
+                    DirN > (REF.SOLAR_CONSTANT * coef.C3 * cos_pow_sza) + 10],
+                   [-1, 5, 3, 6, -1, 4, 2])
+
+
+def QC4(SWup, SZA, coef: Coef = default_coef):
+    """SWup [basic limits tests]"""
+    SWup, SZA = _as_array(SWup), _as_array(SZA)
+    cos_pow_sza = cos_pow(SZA, 1.2)
+    return _select([np.isnan(SWup),
+                    SWup < -4,
+                    SWup < -2,
+                    ~_in_range(SZA),
+                    SWup > (REF.SOLAR_CONSTANT * 1.2 * cos_pow_sza) + 50,
+                    SWup > (REF.SOLAR_CONSTANT * coef.D4 * cos_pow_sza) + 55,
+                    SWup > (REF.SOLAR_CONSTANT * coef.C4 * cos_pow_sza) + 50],
+                   [-1, 5, 3, -1, 6, 4, 2])
+
+
+def QC5(LWdn, coef: Coef = default_coef):
+    """LWdn [basic limits tests]"""
+    LWdn = _as_array(LWdn)
+    return _select([np.isnan(LWdn),
+                    LWdn > 700,
+                    LWdn < 40,
+                    LWdn > coef.D6,
+                    LWdn < coef.D5,
+                    LWdn > coef.C6,
+                    LWdn < coef.C5],
+                   [-1, 6, 5, 4, 3, 2, 1])
+
+
+def QC6(LWup, coef: Coef = default_coef):
+    """LWup [basic limits tests]"""
+    LWup = _as_array(LWup)
+    return _select([np.isnan(LWup),
+                    LWup > 900,
+                    LWup < 40,
+                    LWup > coef.D7,
+                    LWup < coef.D8,
+                    LWup > coef.C7,
+                    LWup < coef.C8],
+                   [-1, 6, 5, 4, 3, 2, 1])
+
+
+def QC7(GSW, Dif, DirN, SZA):
+    """GSW/Sum test [non-definitive]"""
+    GSW, Dif, DirN, SZA = _as_array(GSW), _as_array(Dif), _as_array(DirN), _as_array(SZA)
+    missing = np.isnan(GSW) | np.isnan(Dif) | np.isnan(DirN) | np.isnan(SZA)
+    SumSW = Dif + (DirN * np.cos(np.radians(SZA)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = GSW / SumSW
+        return _select([missing,
+                        ~(SZA < 93),
+                        ~(SumSW > 50),
+                        (SZA > 75) & (SZA < 93) & ((ratio < 0.85) | (ratio > 1.15)),
+                        (SZA < 75) & ((ratio < 0.92) | (ratio > 1.08))],
+                       [-1, -1, -1, 2, 1])
+
+
+def QC8(Dif, GSW, SZA):
+    """Dif/GSW test [non-definitive]"""
+    Dif, GSW, SZA = _as_array(Dif), _as_array(GSW), _as_array(SZA)
+    missing = np.isnan(GSW) | np.isnan(Dif) | np.isnan(SZA)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = Dif / GSW
+        return _select([missing,
+                        ~_in_range(SZA),
+                        ~(GSW > 50),
+                        (SZA > 75) & (SZA < 93) & (ratio > 1.10),
+                        (SZA < 75) & (ratio > 1.05)],
+                       [-1, -1, -1, 2, 1])
+
+
+def QC9(SWup, Dif, DirN, GSW, Ta, SZA, coef: Coef = default_coef):
+    """SWup vs Sum SW test"""
+    SWup, Dif, DirN = _as_array(SWup), _as_array(Dif), _as_array(DirN)
+    GSW, Ta, SZA = _as_array(GSW), _as_array(Ta), _as_array(SZA)
+    missing = np.isnan(GSW) | np.isnan(SWup) | np.isnan(Ta)
+    has_sum = ~(np.isnan(Dif) | np.isnan(DirN))
+    SumSW = Dif + (DirN * np.cos(np.radians(SZA)))
+    return _select([missing,
+                    has_sum & (SumSW > 50) & (GSW > 50) & (SWup > SumSW) & (SWup > GSW),
+                    has_sum & (SumSW > 50) & (SWup > SumSW),
+                    has_sum & (Ta < REF.TSWN) & ((SumSW > 50) | (GSW > 50)) & (SWup > (coef.C10 * SumSW + 25)),
+                    has_sum & (Ta >= REF.TSWN) & ((SumSW > 50) | (GSW > 50)) & (SWup > (coef.C9 * SumSW + 25)),
+                    ~has_sum & (GSW > 50) & (SWup > GSW)],
+                   [-1, 5, 3, 2, 1, 4])
+
+
+def QC10(LWdn, Ta, coef: Coef = default_coef):
+    """LWdn to Ta test"""
+    LWdn, Ta = _as_array(LWdn), _as_array(Ta)
+    Ta4 = np.float_power(Ta, 4.)
+    return _select([np.isnan(LWdn) | np.isnan(Ta),
+                    QC19(Ta) != 0,
+                    LWdn > (REF.BOLTZMANN * Ta4 + coef.D12),
+                    LWdn < (coef.D11 * REF.BOLTZMANN * Ta4),
+                    LWdn > (REF.BOLTZMANN * Ta4 + coef.C12),
+                    LWdn < (coef.C11 * REF.BOLTZMANN * Ta4)],
+                   [-1, -1, 4, 3, 2, 1])
+
+
+def QC11(LWup, Ta, coef: Coef = default_coef):
+    """LWup to Ta test"""
+    LWup, Ta = _as_array(LWup), _as_array(Ta)
+    return _select([np.isnan(LWup) | np.isnan(Ta),
+                    QC19(Ta) != 0,
+                    LWup > (REF.BOLTZMANN * np.float_power(Ta + coef.D14, 4.)),
+                    LWup < (REF.BOLTZMANN * np.float_power(Ta - coef.D13, 4.)),
+                    LWup > (REF.BOLTZMANN * np.float_power(Ta + coef.C14, 4.)),
+                    LWup < (REF.BOLTZMANN * np.float_power(Ta - coef.C13, 4.))],
+                   [-1, -1, 4, 3, 2, 1])
+
+
+def QC12(LWdn, LWup, coef: Coef = default_coef):
+    """LWdn to LWup test"""
+    LWdn, LWup = _as_array(LWdn), _as_array(LWup)
+    return _select([np.isnan(LWdn) | np.isnan(LWup),
+                    LWdn > LWup + coef.D16,
+                    LWdn < LWup - coef.D15,
+                    LWdn > LWup + coef.C16,
+                    LWdn < LWup - coef.C15],
+                   [-1, 4, 3, 2, 1])
+
+
+def QC13(Tc, Ta, coef: Coef = default_coef):
+    """LWdn Tc vs Ta"""
+    Tc, Ta = _as_array(Tc), _as_array(Ta)
+    return _select([np.isnan(Tc) | np.isnan(Ta),
+                    Tc > Ta + coef.C17D,
+                    Tc < Ta - coef.C17D],
+                   [-1, 4, 3])
+
+
+def QC14(Td, Ta, coef: Coef = default_coef):
+    """LWdn Td vs Ta"""
+    Td, Ta = _as_array(Td), _as_array(Ta)
+    return _select([np.isnan(Td) | np.isnan(Ta),
+                    Td > Ta + coef.C17D,
+                    Td < Ta - coef.C17D],
+                   [-1, 4, 3])
+
+
+def QC15(Tc, Ta):
+    """LWup Tc vs Ta"""
+    # Do not have Tc from LWup
+    return np.full(np.broadcast(_as_array(Tc), _as_array(Ta)).shape, -1, dtype=np.int8)
+
+
+def QC16(Td, Ta):
+    """LWup Td vs Ta"""
+    # Do not have Td from LWup
+    return np.full(np.broadcast(_as_array(Td), _as_array(Ta)).shape, -1, dtype=np.int8)
+
+
+def QC17(Tc, Td, coef: Coef = default_coef):
+    """LWdn Tc vs Td"""
+    Tc, Td = _as_array(Tc), _as_array(Td)
+    return _select([np.isnan(Tc) | np.isnan(Td),
+                    (Tc - Td) > coef.C19,
+                    (Tc - Td) < coef.C18],
+                   [-1, 4, 3])
+
+
+def QC18(Tc, Td):
+    """LWup Tc vs Td"""
+    # Do not have Tc and Td from LWup
+    return np.full(np.broadcast(_as_array(Tc), _as_array(Td)).shape, -1, dtype=np.int8)
+
+
+def QC19(Ta):
+    """Ta testing"""
+    Ta = _as_array(Ta)
+    return _select([np.isnan(Ta),
+                    (Ta > 350) | (Ta < 170)],
+                   [-1, 1])
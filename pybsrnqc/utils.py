@@ -1,6 +1,19 @@
 #!/usr/bin/env python3
+import os
+import re
+
+import numpy as np
 import pandas as pd
 import pvlib
+from pvlib import spa
+
+from pybsrnqc.profiling import profiled
+from pybsrnqc.zenith_cache import ZenithCache
+
+INTERPOLATION_STEP = 180  # minutes between two exact computations of the 'interpolated' method
+
+# Raw files of a directory, the other files being the results of the QC
+RAW_FILE_PATTERN = re.compile(r'^\d{6}_raw\.csv$')
 
 
 def isfloat(value):
@@ -12,10 +25,84 @@ def isfloat(value):
         return False
 
 
-def getZenith(timestamp_list, lat, lon, alt):
-    """From list of timestamp, return a pandas serie that associates time with its zenith angle"""
+def findRawFiles(path):
+    """Return the sorted paths of the YYYYMM_raw.csv files of a directory"""
+    return [os.path.join(path, name) for name in sorted(os.listdir(path)) if RAW_FILE_PATTERN.match(name)]
+
+
+def _lagrange(u, values, i):
+    """Cubic interpolation at u in [0, 1[ between the values i and i + 1, through the values i - 1 to i + 2"""
+    return (- u * (u - 1) * (u - 2) / 6 * values[i - 1]
+            + (u + 1) * (u - 1) * (u - 2) / 2 * values[i]
+            - (u + 1) * u * (u - 2) / 2 * values[i + 1]
+            + (u + 1) * u * (u - 1) / 6 * values[i + 2])
+
+
+def interpolateZenith(date_time: pd.DatetimeIndex, lat, lon, alt, step=INTERPOLATION_STEP):
+    """Zenith of the NREL SPA with the ephemeris of the sun computed every step minutes
+    The right ascension, declination, nutation and parallax of the sun, which are the costly part of the
+    SPA and vary slowly, are interpolated with cubics. The hour angle and the topocentric zenith are
+    then computed exactly for each time.
+    Maximal error against nrel_numpy, every minute of 2019 for latitudes between -90 and 90 degrees :
+    1e-9 degree with a step of 180 minutes, 1e-6 degree with a daily step"""
+    if date_time.tz is not None:
+        date_time = date_time.tz_convert('UTC').tz_localize(None)
+    nanoseconds = date_time.values.astype('datetime64[ns]').astype(np.int64)
+    h = step * 60 * 10**9
+    k = nanoseconds // h
+    u = (nanoseconds - k * h) / h
+    # ephemeris of the sun on the nodes surrounding the times
+    k_unique = np.unique(k)
+    nodes = np.unique(np.concatenate([k_unique - 1, k_unique, k_unique + 1, k_unique + 2]))
+    unixtime = nodes * h / 10**9
+    # pressure, temperature, delta_t and refraction as in pvlib.solarposition.spa_python
+    pressure = pvlib.atmosphere.alt2pres(alt) / 100
+    delta_t = 67.0
+    v, alpha, delta = spa.solar_position(unixtime, lat, lon, alt, pressure, 12, delta_t, 0.5667, sst=True)
+    R = spa.solar_position(unixtime, lat, lon, alt, pressure, 12, delta_t, 0.5667, esd=True)[0]
+    jd = spa.julian_day(unixtime)
+    nutation = (v - spa.mean_sidereal_time(jd, spa.julian_century(jd)) + 180) % 360 - 180
+    alpha = np.degrees(np.unwrap(np.radians(alpha)))
+    xi = spa.equatorial_horizontal_parallax(R)
+    # interpolation and exact topocentric computation for each time
+    i = np.searchsorted(nodes, k)
+    jd = spa.julian_day(nanoseconds / 10**9)
+    v = spa.mean_sidereal_time(jd, spa.julian_century(jd)) + _lagrange(u, nutation, i)
+    H = spa.local_hour_angle(v, lon, _lagrange(u, alpha, i))
+    delta, xi = _lagrange(u, delta, i), _lagrange(u, xi, i)
+    x = spa.xterm(spa.uterm(lat), lat, alt)
+    y = spa.yterm(spa.uterm(lat), lat, alt)
+    delta_alpha = spa.parallax_sun_right_ascension(x, xi, H, delta)
+    delta_prime = spa.topocentric_sun_declination(delta, x, y, xi, delta_alpha, H)
+    H_prime = spa.topocentric_local_hour_angle(H, delta_alpha)
+    e0 = spa.topocentric_elevation_angle_without_atmosphere(lat, delta_prime, H_prime)
+    return spa.topocentric_zenith_angle(e0)
+
+
+@profiled()
+def getZenith(timestamp_list, lat, lon, alt, method='nrel_numpy', cache=None, cache_size=1000):
+    """From list of timestamp, return a pandas serie that associates time with its zenith angle
+    method : a pvlib solar position method, or 'interpolated' (see interpolateZenith)
+    cache = None means the zenith is always computed
+    cache = path of a directory means the zenith is kept there and only computed for new minutes
+    cache_size : size limit of the cache in MB"""
     # get local time from timestamp row with pandas approach
     date_time_utc = pd.to_datetime(timestamp_list)
-    # get Solar Zenith Angle
-    pv = pvlib.solarposition.get_solarposition(date_time_utc, lat, lon, alt, pressure=None, method='nrel_numpy')
-    return pv.zenith
+
+    def compute(date_time):
+        if method == 'interpolated':
+            return pd.Series(interpolateZenith(date_time, lat, lon, alt), index=date_time, name='zenith')
+        # get Solar Zenith Angle
+        pv = pvlib.solarposition.get_solarposition(date_time, lat, lon, alt, pressure=None, method=method)
+        return pv.zenith
+
+    if cache is None:
+        return compute(date_time_utc)
+    zenith = ZenithCache(cache, lat, lon, alt, method, cache_size).get(date_time_utc, compute)
+    return pd.Series(zenith, index=date_time_utc, name='zenith')
+
+
+def getStationZenith(timestamp_list, station):
+    """getZenith with the location, the method and the cache of a Station"""
+    return getZenith(timestamp_list, station.LAT, station.LON, station.ALT, method=station.ZENITH_METHOD,
+                     cache=station.ZENITH_CACHE, cache_size=station.ZENITH_CACHE_SIZE)
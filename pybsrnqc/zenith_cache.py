@@ -0,0 +1,88 @@
+"""
+Module that keeps the computed solar zenith angles on disk
+
+The zenith of a station is stored minute by minute in one block per year
+(a .npy file that is memory mapped), NaN meaning not computed yet. Blocks are
+stored in a directory per (LAT, LON, ALT, method) and the least recently used
+ones are removed when the cache gets bigger than its size limit.
+"""
+
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from pybsrnqc import disk_cache
+
+MINUTE = 60 * 10**9  # one minute in nanoseconds
+
+
+class ZenithCache:
+
+    def __init__(self, path, lat, lon, alt, method='nrel_numpy', max_size=1000):
+        """path : directory of the cache, shared by all the stations
+        max_size : size limit of the whole cache in MB"""
+        self.path = path
+        self.directory = os.path.join(path, f'{lat}_{lon}_{alt}_{method}')
+        self.max_size = max_size * 10**6
+        os.makedirs(self.directory, exist_ok=True)
+
+    def block_path(self, year):
+        return os.path.join(self.directory, f'{year}.npy')
+
+    def open_block(self, year, mode='r'):
+        """Memory map the block of a year, creating it if it does not exist"""
+        path = self.block_path(year)
+        while True:
+            if not os.path.exists(path):
+                start = pd.Timestamp(year=year, month=1, day=1).value // MINUTE
+                end = pd.Timestamp(year=year + 1, month=1, day=1).value // MINUTE
+                tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+                block = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float64, shape=(end - start,))
+                block[:] = np.nan
+                block.flush()
+                del block
+                os.replace(tmp_path, path)
+            try:
+                return np.load(path, mmap_mode=mode)
+            except FileNotFoundError:
+                # evicted by another process in the meantime : the block is created again
+                pass
+
+    def get(self, date_time_utc: pd.DatetimeIndex, compute):
+        """Return the zenith of each time as an array
+        compute is called with the times that are not in the cache yet and returns their zenith"""
+        if date_time_utc.tz is not None:
+            date_time_utc = date_time_utc.tz_convert('UTC').tz_localize(None)
+        nanoseconds = date_time_utc.values.astype('datetime64[ns]').astype(np.int64)
+        zenith = np.empty(len(nanoseconds))
+        # only the times on an exact minute are stored
+        on_minute = nanoseconds % MINUTE == 0
+        if not on_minute.all():
+            zenith[~on_minute] = compute(date_time_utc[~on_minute])
+        years = date_time_utc.year.to_numpy()
+        for year in np.unique(years[on_minute]).tolist():
+            selection = np.flatnonzero(on_minute & (years == year))
+            start = pd.Timestamp(year=year, month=1, day=1).value // MINUTE
+            position = nanoseconds[selection] // MINUTE - start
+            block = self.open_block(year)
+            values = block[position]
+            missing = np.isnan(values)
+            if missing.any():
+                # compute the missing minutes once and write them in the block
+                position_missing, inverse = np.unique(position[missing], return_inverse=True)
+                computed = np.asarray(compute(pd.DatetimeIndex((start + position_missing) * MINUTE)), dtype=float)
+                block = self.open_block(year, mode='r+')
+                block[position_missing] = computed
+                block.flush()
+                values[missing] = computed[inverse]
+            del block
+            disk_cache.touch(self.block_path(year))
+            zenith[selection] = values
+        self.evict()
+        return zenith
+
+    def evict(self):
+        """Remove the least recently used blocks while the cache is bigger than its size limit"""
+        disk_cache.evict(self.path, self.max_size)
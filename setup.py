@@ -22,6 +22,9 @@ setup(
                       'pytz>=2019.3',
                       'scikit-learn'
                       ],
+    entry_points={
+        'console_scripts': ['pybsrnqc=pybsrnqc.cli:main'],
+    },
     long_description=long_description,
     long_description_content_type='text/markdown',
     classifiers=[
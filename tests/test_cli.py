@@ -0,0 +1,64 @@
+"""Tests of the command line interface on a synthetic directory"""
+
+import json
+import os
+import sys
+
+import pytest
+
+from pybsrnqc import cli
+from pybsrnqc.automaticQC import generateQCDirectory
+from pybsrnqc.utils import findRawFiles
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from synthetic import make_month  # noqa: E402
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """Directory with two short YYYYMM_raw.csv files"""
+    for year, month in [(2019, 1), (2019, 2)]:
+        make_month(year, month).iloc[:3 * 1440].to_csv(tmp_path / f'{year}{month:02d}_raw.csv', index=False)
+    return tmp_path
+
+
+@pytest.mark.parametrize('output', ['csv', 'npz'])
+def test_calibrate_after_qc(dataset, tmp_path, output):
+    """calibrate reads only the raw files of a directory where qc has written its results"""
+    assert cli.main(['qc', str(dataset), '--format', output]) == 0
+    assert len(os.listdir(dataset)) > 2
+    assert [os.path.basename(f) for f in findRawFiles(str(dataset))] == ['201901_raw.csv', '201902_raw.csv']
+
+    conf = tmp_path / 'conf.json'
+    assert cli.main(['calibrate', str(dataset), '--qcs', 'QC1', '--levels', 'level_2', '--nb-try', '20',
+                     '--kde-engine', 'binned', '--output', str(conf)]) == 0
+    with open(conf) as f:
+        assert 'D1' in json.load(f)['COEF']
+
+
+def test_crossval_after_qc(dataset):
+    """crossval reads only the raw files of a directory where qc has written its results"""
+    assert cli.main(['qc', str(dataset)]) == 0
+    assert cli.main(['crossval', str(dataset), '--qc', 'QC1', '--kde-engine', 'binned']) == 0
+
+
+def test_incremental_npz_rejected(dataset, capsys):
+    """The incremental QC writes csv files : the npz output is refused, nothing is written"""
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(['qc', str(dataset), '--incremental', '--format', 'npz'])
+    assert exit_info.value.code == 2
+    assert '--format npz' in capsys.readouterr().err
+    assert sorted(os.listdir(dataset)) == ['201901_raw.csv', '201902_raw.csv']
+    with pytest.raises(ValueError):
+        generateQCDirectory(str(dataset), incremental=True, output='npz')
+
+
+def test_incremental_chunksize_rejected(dataset, capsys):
+    """The incremental QC processes the appended rows at once : chunksize is refused, nothing is written"""
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(['qc', str(dataset), '--incremental', '--chunksize', '100'])
+    assert exit_info.value.code == 2
+    assert '--chunksize' in capsys.readouterr().err
+    assert sorted(os.listdir(dataset)) == ['201901_raw.csv', '201902_raw.csv']
+    with pytest.raises(ValueError):
+        generateQCDirectory(str(dataset), chunksize=100, incremental=True)
@@ -0,0 +1,32 @@
+"""Tests of the calibration functions of coef_calculator"""
+
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+from pybsrnqc import coef_calculator
+from pybsrnqc.open_data import open_all
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from synthetic import make_month  # noqa: E402
+
+
+@pytest.mark.parametrize('select_day', [False, True])
+def test_cross_validate_open_all(tmp_path, select_day):
+    """The timestamps are found in the columns or in the index (select_day = True)"""
+    for year, month in [(2019, 1), (2019, 2)]:
+        make_month(year, month).iloc[:3 * 1440].to_csv(tmp_path / f'{year}{month:02d}_raw.csv', index=False)
+    df = open_all(str(tmp_path), select_day=select_day)
+    assert ('timestamp' in df.columns) != select_day
+    df_folds, _ = coef_calculator.cross_validate(df, 'QC1', kde_engine='binned')
+    assert set(df_folds['test_months']) == {'2019-01', '2019-02'}
+
+
+def test_calibrate_threshold_missing(capsys):
+    """A dict of thresholds without all the QC studied is refused before any KDE"""
+    df = pd.DataFrame(columns=['timestamp', 'SZA', 'global2_avg', 'direct_avg', 'temperature', 'downward_avg'])
+    with pytest.raises(ValueError, match='QC3'):
+        coef_calculator.calibrate(df, qcs=['QC1', 'QC3'], threshold={'QC1': -15.})
+    assert 'KDE' not in capsys.readouterr().out
@@ -0,0 +1,263 @@
+"""Tests of the search of the best coefficients, against the loops on each coefficient they replace"""
+
+import math
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn import metrics as skm
+
+from pybsrnqc import coef_study as cs
+from pybsrnqc import qcrad as qcr
+from pybsrnqc import plot_limits as pl
+from pybsrnqc import qc_functions as qcf
+from pybsrnqc.config import Coef
+from pybsrnqc.coef_study import adaptive_search
+from pybsrnqc.open_data import open_all
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from synthetic import make_month  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def df(tmp_path_factory):
+    """Two days of synthetic data, as given by open_all"""
+    path = tmp_path_factory.mktemp('dataset')
+    make_month(2019, 1).iloc[:2 * 1440].to_csv(path / '201901_raw.csv', index=False)
+    return open_all(str(path)).reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def log_kernels(df):
+    """Binned KDE of each QC studied"""
+    return {name: pl.kde_computing(df, QC(), display=False, save=None, engine='binned')
+            for name, QC in [('QC1', qcf.QC1), ('QC3', qcf.QC3), ('QC5', qcf.QC5), ('QC10', qcf.QC10)]}
+
+
+def loop_flags(df, QC, coefs):
+    """Flags of df for one configuration, changed by coefs (name -> value)"""
+    dic = Coef()
+    for name, value in coefs.items():
+        dic.__setattr__(name, value)
+    return np.asarray(QC.calc_lim(df, coef=dic)[3])
+
+
+def loop_scores(y_true, out_coef):
+    """Scores of sklearn, as computed by calc_coef for each coefficient"""
+    return {'accuracy_score': skm.accuracy_score(y_true, out_coef),
+            'precision_score': skm.precision_score(y_true, out_coef, zero_division=0),
+            'recall_score': skm.recall_score(y_true, out_coef, zero_division=0),
+            'f1_score': skm.f1_score(y_true, out_coef, zero_division=0)}
+
+
+@pytest.mark.parametrize('best', [0.3, 0.37, 0.7, 0.123, 1.0])
+def test_adaptive_search_evaluates_once(best):
+    """Each coefficient is evaluated once, the values given by arange at each step being rounded differently"""
+    evaluated = []
+
+    def evaluate(values):
+        evaluated.extend(values)
+        return {'f1_score': -np.abs(np.asarray(values) - best)}
+
+    values, scores = adaptive_search(evaluate, [0.0, 1.2], 0.1, 1e-4)
+    assert sorted(evaluated) == values
+    assert np.diff(values).min() > 1e-4 / 2
+    assert abs(values[int(np.argmax(scores['f1_score']))] - best) < 1e-4 / 2
+
+
+@pytest.mark.parametrize('QC, coef_name', [(qcf.QC1, 'D1'), (qcf.QC3, 'C3'), (qcf.QC5, 'D5'), (qcf.QC10, 'D12')])
+def test_sweep_flags_blocks(df, QC, coef_name):
+    """The flags of the blocks of coefficients are the ones of calc_lim for each coefficient"""
+    QC = QC()
+    values = np.linspace(*(QC.coef_range_min if coef_name == 'D5' else QC.coef_range), 25)
+    flags = np.concatenate(list(cs.sweep_flags(df, QC, coef_name, values, block_size=4 * len(df))))
+    assert flags.shape == (len(values), len(df))
+    for value, flags_value in zip(values, flags):
+        np.testing.assert_array_equal(flags_value, loop_flags(df, QC, {coef_name: value}))
+
+
+@pytest.mark.parametrize('name, level', [('QC1', 'level_2'), ('QC3', 'level_1'), ('QC5', 'level_2'),
+                                         ('QC10', 'level_1')])
+def test_calc_coef_loop(df, log_kernels, name, level):
+    """df_scores and line_max of calc_coef are the ones of the loop on each coefficient"""
+    QC = getattr(qcf, name)()
+    ranges = {'coef_range': QC.coef_range, 'step': (QC.coef_range[1] - QC.coef_range[0]) / 50}
+    if QC.vary == 'downward_avg':
+        ranges.update(coef_range_min=QC.coef_range_min, step_min=(QC.coef_range_min[1] - QC.coef_range_min[0]) / 50)
+    data = df.copy()
+    results = cs.calc_coef(data, log_kernels[name], QC, -8., level=level, verbose=False, selected=[], **ranges)
+
+    limits = [(QC.coefficients[level], ranges['coef_range'], ranges['step'], [2, 4] if level == 'level_1' else [4])]
+    if QC.vary == 'downward_avg':
+        limits.append((QC.coefficients[level + '_min'], ranges['coef_range_min'], ranges['step_min'],
+                       [1, 3] if level == 'level_1' else [3]))
+    for (coef_name, coef_range, step, out_flags), df_scores, line_max in zip(limits, results[::2], results[1::2]):
+        values = list(np.arange(coef_range[0], coef_range[1], step))
+        expected = pd.DataFrame([{coef_name: value, **loop_scores(data['out_density'],
+                                                                  np.isin(loop_flags(df, QC, {coef_name: value}),
+                                                                          out_flags))}
+                                 for value in values])
+        pd.testing.assert_frame_equal(df_scores, expected, check_exact=False, rtol=1e-12, check_column_type=False)
+        assert list(line_max.index) == list(expected.index[expected['f1_score'] == expected['f1_score'].max()])
+
+
+@pytest.mark.parametrize('name, level, lower, coef_range', [('QC1', 'level_2', False, [0.0, 1.2]),
+                                                            ('QC3', 'level_1', False, [0.0, 1.0]),
+                                                            ('QC5', 'level_2', True, [200.0, 400.0]),
+                                                            ('QC10', 'level_2', False, [-200.0, 100.0]),
+                                                            ('QC10', 'level_1', True, [0.6, 1.0])])
+def test_exact_scores_brute_force(df, log_kernels, name, level, lower, coef_range):
+    """The critical coefficients give the outliers of the flags on both sides of each of them, exact_scores
+    the scores of the flags inside the intervals of coefficients"""
+    QC = getattr(qcf, name)()
+    coef_name = QC.coefficients[level + '_min' if lower else level]
+    out_flags = cs._out_flags(level, lower)
+    data = df.copy()
+    cs.label_density(data, log_kernels[name], QC, -8., [])
+    critical = cs.critical_coef(df, QC, level, lower=lower)
+    rng = np.random.default_rng(0)
+
+    def outliers(value):
+        return np.isin(loop_flags(df, QC, {coef_name: value}), out_flags)
+
+    inside = np.unique(critical[(critical > coef_range[0]) & (critical < coef_range[1])])
+    assert len(inside) > 100
+    values = np.linspace(*coef_range, 30)
+    for value in rng.choice(inside, 10, replace=False):
+        values = np.append(values, [np.nextafter(value, -np.inf), value, np.nextafter(value, np.inf)])
+    for value in values:
+        np.testing.assert_array_equal(outliers(value), critical <= value if lower else critical >= value)
+
+    df_scores = cs.exact_scores(critical, data['out_density'], coef_name, coef_range, lower)
+    assert df_scores['coef_from'].iloc[0] == coef_range[0] and df_scores['coef_to'].iloc[-1] == coef_range[1]
+    best = df_scores.index[df_scores['f1_score'] == df_scores['f1_score'].max()]
+    for k in np.union1d(rng.choice(len(df_scores), 40, replace=False), best):
+        line = df_scores.loc[k]
+        expected = loop_scores(data['out_density'], outliers(line[coef_name]))
+        assert line[list(expected)].to_dict() == pytest.approx(expected, abs=1e-12)
+    # no coefficient tried scores better than the best interval
+    tried = max(loop_scores(data['out_density'], outliers(value))['f1_score'] for value in values)
+    assert tried <= df_scores['f1_score'].max() + 1e-12
+
+
+@pytest.mark.parametrize('name, level, coef_range, coef_range_min', [('QC5', 'level_2', [350.0, 450.0], [200.0, 400.0]),
+                                                                     ('QC10', 'level_2', [-200.0, 100.0], [0.6, 1.0]),
+                                                                     ('QC10', 'level_1', [-200.0, 100.0], [0.6, 1.0])])
+def test_joint_scores_brute_force(df, log_kernels, name, level, coef_range, coef_range_min):
+    """The scores of each couple of coefficients are the ones of the flags with both coefficients changed"""
+    QC = getattr(qcf, name)()
+    coef_name, coef_name_min = QC.coefficients[level], QC.coefficients[level + '_min']
+    data = df.copy()
+    cs.label_density(data, log_kernels[name], QC, -8., [])
+    upper_names = [QC.coefficients['level_1'], QC.coefficients['level_2']]
+    lower_names = [QC.coefficients['level_1_min'], QC.coefficients['level_2_min']]
+    critical = cs.critical_coef(df, QC, level, others={name: -np.inf for name in lower_names})
+    critical_min = cs.critical_coef(df, QC, level, lower=True, others={name: np.inf for name in upper_names})
+    values, values_min = np.linspace(*coef_range, 15), np.linspace(*coef_range_min, 12)
+
+    scores = cs.joint_scores(critical, critical_min, data['out_density'], values, values_min)
+    out_flags = cs._out_flags(level) + cs._out_flags(level, lower=True)
+    for i, value in enumerate(values):
+        for j, value_min in enumerate(values_min):
+            outliers = np.isin(loop_flags(df, QC, {coef_name: value, coef_name_min: value_min}), out_flags)
+            expected = loop_scores(data['out_density'], outliers)
+            assert {name: scores[name][i, j] for name in expected} == pytest.approx(expected, abs=1e-12), (i, j)
+
+
+def loop_variation(df, QC, coef_name, values, flag):
+    """Indicators of the outliers (flag) for each coefficient, as computed by coef_variation with pandas"""
+    rows = []
+    for value in values:
+        log_kde = df['log_kde'][loop_flags(df, QC, {coef_name: value}) == flag]
+        rows.append({'nb_out': float(len(log_kde)), 'kde_mean': log_kde.mean(), 'kde_sum': log_kde.sum(),
+                     'coefs': value, 'std': log_kde.std()})
+    return pd.DataFrame(rows)
+
+
+@pytest.mark.parametrize('name', ['QC1', 'QC3', 'QC5', 'QC10'])
+def test_coef_variation_loop(df, log_kernels, name, monkeypatch):
+    """The indicators of coef_variation are the ones of the loop on each coefficient, for both limits"""
+    monkeypatch.setattr(cs.plt, 'show', lambda: cs.plt.close('all'))
+    QC = getattr(qcf, name)()
+    coef_range, step = QC.coef_range, (QC.coef_range[1] - QC.coef_range[0]) / 40
+    ranges = {}
+    if QC.vary == 'downward_avg':
+        ranges = {'coef_range_min': QC.coef_range_min, 'step_min': (QC.coef_range_min[1] - QC.coef_range_min[0]) / 40}
+    data = df.copy()
+    results = cs.coef_variation(data, log_kernels[name], QC, coef_range=coef_range, step=step, verbose=False,
+                                **ranges)
+    results = results if isinstance(results, tuple) else (results,)
+
+    data_min = data.loc[data['downward_avg'] <= 400]
+    expected = [loop_variation(data, QC, QC.coefficients['level_2'], np.arange(*coef_range, step), 4)]
+    if QC.vary == 'downward_avg':
+        expected.append(loop_variation(data_min, QC, QC.coefficients['level_2_min'],
+                                       np.arange(*ranges['coef_range_min'], ranges['step_min']), 3))
+    assert len(results) == len(expected)
+    for df_var, df_expected in zip(results, expected):
+        assert (df_expected['nb_out'] > 0).any()
+        pd.testing.assert_frame_equal(df_var.reset_index(drop=True), df_expected[list(df_var.columns)],
+                                      check_exact=False, rtol=1e-9, atol=1e-9, check_column_type=False)
+
+
+@pytest.mark.parametrize('name', ['QC1', 'QC3', 'QC5', 'QC10'])
+def test_threshold_var_loop(df, log_kernels, name):
+    """The number of outliers by density of each threshold is the one of the loop on the thresholds, df being
+    left unchanged"""
+    log_kernel = log_kernels[name]
+    data = df.copy()
+    df_var = cs.threshold_var(data, log_kernel, step=0.05, display=False)
+    pd.testing.assert_frame_equal(data, df)
+    thresholds = np.arange(np.min(log_kernel), np.max(log_kernel), 0.05)
+    expected = pd.DataFrame({'nb_out_density': [float((log_kernel <= threshold).sum()) for threshold in thresholds],
+                             'thresholds': thresholds})
+    pd.testing.assert_frame_equal(df_var.reset_index(drop=True), expected, check_column_type=False)
+    # the thresholds on the densities themselves
+    df_var = cs.threshold_var(data, log_kernel, threshold_range=[np.min(log_kernel), np.max(log_kernel) + 1],
+                              step=1., display=False)
+    assert df_var['nb_out_density'].iloc[0] == (log_kernel == np.min(log_kernel)).sum()
+
+
+def _cos_pow(SZA, exponent):
+    return math.pow(math.cos(math.radians(SZA)), exponent)
+
+
+# Former limits (f) and labels (lab) of the QC classes, computed sample by sample
+LOOP_QCS = {
+    'QC1': (lambda GSW, SZA, c: (qcr.REF.SOLAR_CONSTANT * c.C1 * _cos_pow(SZA, 1.2) + 50,
+                                 qcr.REF.SOLAR_CONSTANT * c.D1 * _cos_pow(SZA, 1.2) + 55,
+                                 qcr.REF.SOLAR_CONSTANT * 1.5 * _cos_pow(SZA, 1.2) + 100),
+            lambda GSW, SZA, c: qcr.QC1(GSW, SZA, c)),
+    'QC3': (lambda DirN, SZA, c: (qcr.REF.SOLAR_CONSTANT * c.C3 * _cos_pow(SZA, 0.2) + 10,
+                                  qcr.REF.SOLAR_CONSTANT * c.D3 * _cos_pow(SZA, 0.2) + 15,
+                                  qcr.REF.SOLAR_CONSTANT),
+            lambda DirN, SZA, c: qcr.QC3(DirN, SZA, c)),
+    'QC5': (lambda LWdn, SZA, c: (c.C6, c.D6, 700, c.C5, c.D5, 40),
+            lambda LWdn, SZA, c: qcr.QC5(LWdn, c)),
+    'QC10': (lambda LWdn, Ta, c: (qcr.REF.BOLTZMANN * math.pow(Ta + 273.15, 4) + c.C12,
+                                  qcr.REF.BOLTZMANN * math.pow(Ta + 273.15, 4) + c.D12, 700,
+                                  c.C11 * qcr.REF.BOLTZMANN * math.pow(Ta + 274.15, 4),
+                                  c.D11 * qcr.REF.BOLTZMANN * math.pow(Ta + 274.15, 4), 40),
+             lambda LWdn, Ta, c: qcr.QC10(LWdn, Ta + 273.15, c))}
+
+
+@pytest.mark.parametrize('name', list(LOOP_QCS))
+@pytest.mark.parametrize('coefs', [{}, {'C1': 0.5, 'D1': 0.6, 'C3': 0.4, 'D3': 0.5, 'C5': 300., 'D5': 250.,
+                                        'C6': 420., 'D6': 450., 'C11': 0.85, 'D11': 0.8, 'C12': -60., 'D12': -40.}])
+def test_calc_lim_loop(df, name, coefs):
+    """The limits and the labels of calc_lim on whole columns are the ones computed sample by sample"""
+    QC = getattr(qcf, name)()
+    f, lab = LOOP_QCS[name]
+    dic = Coef()
+    for key, value in coefs.items():
+        dic.__setattr__(key, value)
+    result = QC.calc_lim(df, dic)
+    X, Y = df[QC.varx].to_numpy(dtype=float), df[QC.vary].to_numpy(dtype=float)
+    limits = np.array([f(y, x, dic) for x, y in zip(X, Y)], dtype=float).T
+    labels = np.array([lab(y, x, dic) for x, y in zip(X, Y)])
+    assert len(set(labels)) > 1
+    np.testing.assert_array_equal(result[3], labels)
+    for computed, expected in zip(result[:3] + result[4:], limits):
+        np.testing.assert_array_equal(computed, expected)
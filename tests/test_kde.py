@@ -0,0 +1,102 @@
+"""Tests of the KDE engines and of kde_computing"""
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from pybsrnqc import kde
+from pybsrnqc import plot_limits as pl
+from pybsrnqc import qc_functions as qcf
+from pybsrnqc.kde_cache import KdeCache
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    sza = rng.uniform(0, 90, 3000)
+    return pd.DataFrame({'SZA': sza, 'global2_avg': 1000 * np.cos(np.radians(sza)) + rng.normal(0, 30, 3000)})
+
+
+@pytest.fixture
+def X(df):
+    """Samples of df (dimensions x samples) with some outliers far in the tails"""
+    rng = np.random.default_rng(1)
+    outliers = np.stack([rng.uniform(-400, 1800, 20), rng.uniform(0, 90, 20)])
+    return np.concatenate([np.array(df[['global2_avg', 'SZA']]).T, outliers], axis=1)
+
+
+def test_exact_kde_by_chunks(df):
+    """The exact KDE by chunks in threads is the one of a single call of gaussian_kde"""
+    X = np.array(df[['global2_avg', 'SZA']]).T
+    expected = stats.gaussian_kde(X)(X)
+    assert np.array_equal(kde.exact_kde(X, jobs=3, memory=8 * (4 * X.shape[1] + 5 * 50)), expected)
+
+
+@pytest.mark.parametrize('progress, lines', [(False, 0), (True, 10)])
+def test_kde_computing_progress(df, capsys, progress, lines):
+    """The progress of the exact KDE is only printed when asked, every tenth of the chunks"""
+    pl.kde_computing(df, qcf.QC1(), display=False, save=None, progress=progress)
+    assert capsys.readouterr().out.count('chunks of the KDE') == lines
+
+
+def test_kde_cache_evicted_meanwhile(df, tmp_path, monkeypatch):
+    """A density evicted by another process between its reading and the update of its access time is still
+    returned, and the densities evicted before their reading are computed again"""
+    X = np.array(df[['global2_avg', 'SZA']]).T
+    cache = KdeCache(str(tmp_path), max_size=1)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.arange(X.shape[1], dtype=float)
+
+    expected = cache.get(X, None, 'exact', compute)
+    utime = os.utime
+
+    def evicted_utime(path, *args, **kwargs):
+        os.remove(path)
+        utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'utime', evicted_utime)
+    assert np.array_equal(cache.get(X, None, 'exact', compute), expected) and len(calls) == 1
+    assert np.array_equal(cache.get(X, None, 'exact', compute), expected) and len(calls) == 2
+
+
+@pytest.mark.parametrize('bw_method', [None, 'silverman', 0.3])
+@pytest.mark.parametrize('grid_size', [64, 256, kde.GRID_SIZE])
+def test_binned_kde_error_bound(X, bw_method, grid_size):
+    """The binned density is within its returned bound of the exact one at every sample"""
+    binned, bound = kde.binned_kde(X, bw_method, grid_size)
+    exact = stats.gaussian_kde(X, bw_method=bw_method)(X)
+    assert binned.shape == exact.shape
+    assert np.abs(binned - exact).max() <= bound
+    if grid_size == kde.GRID_SIZE:
+        # a bound that is useful : a few percent of the density at its peak
+        assert bound < 0.05 * exact.max()
+
+
+@pytest.mark.parametrize('bw_method', [None, 0.3])
+@pytest.mark.parametrize('rtol', [1e-2, kde.RTOL, 1e-5])
+def test_tree_kde_rtol(X, bw_method, rtol):
+    """The relative error of the tree density is under rtol at every sample, in the tails too"""
+    exact = stats.gaussian_kde(X, bw_method=bw_method)(X)
+    tree = kde.tree_kde(X, bw_method, rtol)
+    assert (np.abs(tree - exact) <= rtol * exact).all()
+
+
+@pytest.mark.parametrize('bw_method', [None, 'silverman', 0.3])
+@pytest.mark.parametrize('sampling', ['stratified', 'uniform'])
+def test_fit_kde_pickle(X, bw_method, sampling):
+    """The model fitted on a subsample goes through pickle (as sent to the processes) and scores every sample,
+    with the bandwidth factor of all the samples"""
+    model = kde.fit_kde(X, bw_method, fit_size=500, sampling=sampling)
+    assert model.n <= 500 and model.factor == stats.gaussian_kde(X, bw_method=bw_method).factor
+    restored = pickle.loads(pickle.dumps(model))
+    density = kde.evaluate_kde(restored, X, jobs=2)
+    assert density.shape == (X.shape[1],) and np.isfinite(density).all() and (density > 0).all()
+    assert np.array_equal(density, kde.evaluate_kde(model, X))
+    assert np.array_equal(density, kde.density(X, bw_method, fit_size=500, sampling=sampling))
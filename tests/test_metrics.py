@@ -0,0 +1,51 @@
+"""The scores of metrics are the ones of sklearn.metrics with zero_division=0"""
+
+import numpy as np
+import pytest
+from sklearn import metrics as skm
+
+from pybsrnqc import metrics
+
+N = 500
+
+
+def sklearn_scores(y_true, y_pred):
+    return {'accuracy_score': skm.accuracy_score(y_true, y_pred),
+            'precision_score': skm.precision_score(y_true, y_pred, zero_division=0),
+            'recall_score': skm.recall_score(y_true, y_pred, zero_division=0),
+            'f1_score': skm.f1_score(y_true, y_pred, zero_division=0),
+            'matthews_corrcoef': skm.matthews_corrcoef(y_true, y_pred)}
+
+
+def predictions(rng):
+    """Random predictions, all negative, all positive, perfect and inverted ones"""
+    y_true = (rng.random(N) < 0.1).astype(np.int8)
+    batch = [(rng.random(N) < share).astype(np.int8) for share in (0.05, 0.1, 0.5, 0.9)]
+    batch += [np.zeros(N, dtype=np.int8), np.ones(N, dtype=np.int8), y_true, 1 - y_true]
+    return y_true, np.stack(batch)
+
+
+@pytest.mark.filterwarnings('ignore:A single label was found')
+@pytest.mark.parametrize('y_true', ['random', 'negative', 'positive'])
+def test_batch_scores_sklearn(y_true):
+    """Each line of a batch and each single prediction, with labels of both classes or of only one"""
+    rng = np.random.default_rng(0)
+    labels, batch = predictions(rng)
+    if y_true != 'random':
+        labels = np.full(N, int(y_true == 'positive'), dtype=np.int8)
+    result = metrics.batch_scores(labels, batch)
+    for k, y_pred in enumerate(batch):
+        expected = sklearn_scores(labels, y_pred)
+        single = metrics.batch_scores(labels, y_pred)
+        for name, score in expected.items():
+            assert result[name][k] == pytest.approx(score, abs=1e-12), (name, k)
+            assert single[name] == pytest.approx(score, abs=1e-12), (name, k)
+
+
+def test_confusion_sklearn():
+    rng = np.random.default_rng(1)
+    y_true, batch = predictions(rng)
+    tp, fp, fn, tn = metrics.confusion(y_true, batch)
+    for k, y_pred in enumerate(batch):
+        (expected_tn, expected_fp), (expected_fn, expected_tp) = skm.confusion_matrix(y_true, y_pred, labels=[0, 1])
+        assert (tp[k], fp[k], fn[k], tn[k]) == (expected_tp, expected_fp, expected_fn, expected_tn)
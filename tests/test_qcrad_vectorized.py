@@ -0,0 +1,184 @@
+"""The vectorized qcrad tests give the flags of the scalar ones, element by element"""
+
+import math
+
+import numpy as np
+import pytest
+
+from pybsrnqc import qcrad as qcr
+from pybsrnqc import qcrad_vectorized as vqcr
+from pybsrnqc.config import Coef
+
+N = 20000
+
+# Coefficients used by the tests but missing in qcrad_conf.json
+EXTRA_COEFS = {'C4': 0.7, 'D4': 0.8, 'C7': 500., 'D7': 600., 'C8': 200., 'D8': 150., 'C9': 0.9, 'C10': 1.0,
+               'C13': 10., 'D13': 15., 'C14': 10., 'D14': 15., 'C15': 150., 'D15': 200., 'C16': 5., 'D16': 10.}
+
+
+@pytest.fixture
+def coef():
+    coef = Coef()
+    for key, value in EXTRA_COEFS.items():
+        coef.__setattr__(key, value)
+    return coef
+
+
+@pytest.fixture(autouse=True)
+def snow_temperature(monkeypatch):
+    # QC9 compares Ta with REF.TSWN, None by default
+    monkeypatch.setattr(qcr.REF, 'TSWN', 273.15)
+
+
+def draw(rng, low, high, limits=(), missing=0.1, at_limits=0.3):
+    """N values uniform in [low, high], a share of them NaN and a share exactly at one of the limits
+    (constants or arrays of N values)"""
+    values = rng.uniform(low, high, N)
+    if limits:
+        limits = np.stack([np.broadcast_to(np.asarray(limit, dtype=float), (N,)) for limit in limits])
+        chosen = rng.random(N) < at_limits
+        values[chosen] = limits[rng.integers(len(limits), size=N), np.arange(N)][chosen]
+    values[rng.random(N) < missing] = np.nan
+    return values
+
+
+def draw_sza(rng, missing=0.1):
+    """SZA from -20 to 120 degrees, with the bounds 0 and 90"""
+    return draw(rng, -20, 120, [0., 90., 75., 93.], missing)
+
+
+def cos_pow(SZA, exponent):
+    """cos(SZA)^exponent as in qcrad, NaN outside [0, 90]"""
+    return np.array([math.pow(math.cos(math.radians(z)), exponent) if 0 <= z <= 90 else np.nan for z in SZA])
+
+
+def draw_ta(rng, missing=0.1):
+    """Ta from 150 to 370 K, with the bounds 170 and 350"""
+    return draw(rng, 150, 370, [170., 350.], missing)
+
+
+def scalar_flags(function, *arrays, **kwargs):
+    """Flags of the scalar test on each element, NaN becoming None
+    A missing SZA raises a TypeError in the scalar tests : the test is then not possible (-1)"""
+    flags = []
+    for values in zip(*arrays):
+        values = [None if math.isnan(value) else value for value in values]
+        try:
+            flags.append(function(*values, **kwargs))
+        except TypeError:
+            flags.append(-1)
+    return np.array(flags)
+
+
+def assert_same_flags(name, *arrays, coef=None):
+    kwargs = {} if coef is None else {'coef': coef}
+    expected = scalar_flags(getattr(qcr, name), *arrays, **kwargs)
+    flags = getattr(vqcr, name)(*arrays, **kwargs)
+    assert flags.dtype == np.int8
+    mismatch = np.flatnonzero(flags != expected)
+    assert len(mismatch) == 0, f'{name}: {len(mismatch)} flags differ, first at {[a[mismatch[0]] for a in arrays]}'
+
+
+@pytest.mark.parametrize('name, factor, offsets, exponent', [
+    ('QC1', ('1.5', 'D1', 'C1'), (100, 55, 50), 1.2),
+    ('QC2', ('0.95', 'D2', 'C2'), (50, 35, 30), 1.2),
+    ('QC3', ('D3', 'C3'), (15, 10), 0.2),
+    ('QC4', ('1.2', 'D4', 'C4'), (50, 55, 50), 1.2)])
+def test_shortwave_limits(coef, name, factor, offsets, exponent):
+    rng = np.random.default_rng(1)
+    SZA = draw_sza(rng)
+    limits = [-4., -2., qcr.REF.SOLAR_CONSTANT]
+    for key, offset in zip(factor, offsets):
+        value = float(key) if key[0].isdigit() else getattr(coef, key)
+        limits.append((qcr.REF.SOLAR_CONSTANT * value * cos_pow(SZA, exponent)) + offset)
+    values = draw(rng, -10, 1500, limits)
+    assert_same_flags(name, values, SZA, coef=coef)
+
+
+@pytest.mark.parametrize('name, keys, bounds', [('QC5', ('C5', 'D5', 'C6', 'D6'), (40., 700.)),
+                                                ('QC6', ('C7', 'D7', 'C8', 'D8'), (40., 900.))])
+def test_longwave_limits(coef, name, keys, bounds):
+    rng = np.random.default_rng(2)
+    values = draw(rng, 0, 1000, [getattr(coef, key) for key in keys] + list(bounds))
+    assert_same_flags(name, values, coef=coef)
+
+
+def test_qc7():
+    rng = np.random.default_rng(3)
+    SZA = draw_sza(rng)
+    Dif, DirN = draw(rng, -10, 600), draw(rng, -10, 1100)
+    SumSW = Dif + DirN * np.cos(np.radians(SZA))
+    GSW = draw(rng, -10, 1400, [SumSW * ratio for ratio in (0.85, 1.15, 0.92, 1.08)])
+    assert_same_flags('QC7', GSW, Dif, DirN, SZA)
+
+
+def test_qc8():
+    rng = np.random.default_rng(4)
+    SZA = draw_sza(rng)
+    GSW = draw(rng, -10, 1400, [50.])
+    Dif = draw(rng, -10, 1400, [GSW * 1.10, GSW * 1.05])
+    assert_same_flags('QC8', Dif, GSW, SZA)
+
+
+def test_qc9(coef):
+    rng = np.random.default_rng(5)
+    # the scalar test does not check the SZA, only used with Dif and DirN
+    SZA = draw_sza(rng, missing=0)
+    Dif, DirN, GSW = draw(rng, -10, 600), draw(rng, -10, 1100), draw(rng, -10, 1400, [50.])
+    Ta = draw(rng, 250, 300, [qcr.REF.TSWN])
+    SumSW = Dif + DirN * np.cos(np.radians(SZA))
+    SWup = draw(rng, -10, 1400, [SumSW, GSW, coef.C10 * SumSW + 25, coef.C9 * SumSW + 25])
+    assert_same_flags('QC9', SWup, Dif, DirN, GSW, Ta, SZA, coef=coef)
+
+
+def test_qc10(coef):
+    rng = np.random.default_rng(6)
+    Ta = draw_ta(rng)
+    Ta4 = np.array([math.pow(ta, 4) for ta in Ta])
+    limits = [qcr.REF.BOLTZMANN * Ta4 + coef.D12, coef.D11 * qcr.REF.BOLTZMANN * Ta4,
+              qcr.REF.BOLTZMANN * Ta4 + coef.C12, coef.C11 * qcr.REF.BOLTZMANN * Ta4]
+    LWdn = draw(rng, 0, 900, limits)
+    assert_same_flags('QC10', LWdn, Ta, coef=coef)
+
+
+def test_qc11(coef):
+    rng = np.random.default_rng(7)
+    Ta = draw_ta(rng)
+
+    def limit(shift):
+        return qcr.REF.BOLTZMANN * np.array([math.pow(ta + shift, 4) if ta == ta else np.nan for ta in Ta])
+
+    LWup = draw(rng, 0, 1200, [limit(coef.D14), limit(-coef.D13), limit(coef.C14), limit(-coef.C13)])
+    assert_same_flags('QC11', LWup, Ta, coef=coef)
+
+
+def test_qc12(coef):
+    rng = np.random.default_rng(8)
+    LWup = draw(rng, 0, 900)
+    LWdn = draw(rng, 0, 900, [LWup + coef.D16, LWup - coef.D15, LWup + coef.C16, LWup - coef.C15])
+    assert_same_flags('QC12', LWdn, LWup, coef=coef)
+
+
+@pytest.mark.parametrize('name', ['QC13', 'QC14'])
+def test_temperature_differences(coef, name):
+    rng = np.random.default_rng(9)
+    Ta = draw_ta(rng)
+    T = draw(rng, 150, 370, [Ta + coef.C17D, Ta - coef.C17D])
+    assert_same_flags(name, T, Ta, coef=coef)
+
+
+def test_qc17(coef):
+    rng = np.random.default_rng(10)
+    Td = draw_ta(rng)
+    Tc = draw(rng, 150, 370, [Td + coef.C19, Td + coef.C18])
+    assert_same_flags('QC17', Tc, Td, coef=coef)
+
+
+@pytest.mark.parametrize('name', ['QC15', 'QC16', 'QC18'])
+def test_not_possible(name):
+    rng = np.random.default_rng(11)
+    assert_same_flags(name, draw_ta(rng), draw_ta(rng))
+
+
+def test_qc19():
+    assert_same_flags('QC19', draw_ta(np.random.default_rng(12)))
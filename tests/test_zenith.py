@@ -0,0 +1,94 @@
+"""The interpolated zenith stays within its documented error of the NREL SPA, the zenith cache survives
+blocks removed by another process"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pybsrnqc.automaticQC import compareZenithMethods
+from pybsrnqc.config import Station
+from pybsrnqc.utils import getZenith, interpolateZenith
+from pybsrnqc.zenith_cache import ZenithCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from synthetic import make_month  # noqa: E402
+
+# Maximal errors of interpolateZenith against nrel_numpy, in degree (see its docstring)
+MAX_ERROR = 1e-9
+MAX_ERROR_DAILY = 1e-6
+
+
+@pytest.mark.parametrize('lat, lon, alt', [(-90., 0., 2835), (-66.6, 140., 40), (-20.90146, 55.483593, 97),
+                                           (0., -78.5, 2800), (45., 5., 200), (78.9, 11.9, 10), (90., 0., 0)])
+def test_interpolated_zenith(lat, lon, alt):
+    """Every minute of a year, from the poles to the equator"""
+    minutes = pd.date_range('2019-01-01', '2020-01-01', freq='min', inclusive='left')
+    exact = getZenith(minutes, lat, lon, alt).to_numpy()
+    interpolated = getZenith(minutes, lat, lon, alt, method='interpolated')
+    assert isinstance(interpolated, pd.Series) and interpolated.index.equals(minutes)
+    assert np.abs(interpolated.to_numpy() - exact).max() < MAX_ERROR
+    assert np.abs(interpolateZenith(minutes, lat, lon, alt, step=1440) - exact).max() < MAX_ERROR_DAILY
+
+
+def test_compare_zenith_methods(tmp_path):
+    """The interpolated zenith changes no flag of QC1, QC2 and QC3 on a raw file"""
+    filepath = tmp_path / '201903_raw.csv'
+    make_month(2019, 3).iloc[:7 * 1440].to_csv(filepath, index=False)
+    df_compare = compareZenithMethods(str(filepath), station=Station(), method='interpolated')
+    assert list(df_compare.index) == ['QC1', 'QC2', 'QC3']
+    assert (df_compare['max_zenith_error'] < MAX_ERROR).all()
+    assert (df_compare['changed_flags'] == 0).all()
+
+
+def test_zenith_cache_block_evicted_meanwhile(tmp_path, monkeypatch):
+    """A block removed before its access time is updated, as by the evict of another process"""
+    cache = ZenithCache(str(tmp_path), 45., 5., 200)
+    minutes = pd.date_range('2019-03-01', periods=60, freq='min')
+    utime = os.utime
+
+    def evicted_utime(path, *args, **kwargs):
+        os.remove(path)
+        utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'utime', evicted_utime)
+    zenith = cache.get(minutes, lambda times: getZenith(times, 45., 5., 200).to_numpy())
+    np.testing.assert_array_equal(zenith, getZenith(minutes, 45., 5., 200).to_numpy())
+
+
+def test_zenith_cache_evict_race(tmp_path, monkeypatch):
+    """evict skips the blocks already removed by another process"""
+    cache = ZenithCache(str(tmp_path), 45., 5., 200, max_size=0)
+    for year in (2018, 2019):
+        cache.open_block(year)
+    remove = os.remove
+
+    def concurrent_remove(path):
+        remove(path)
+        remove(path)
+
+    monkeypatch.setattr(os, 'remove', concurrent_remove)
+    cache.evict()
+    assert not os.path.exists(cache.block_path(2018)) and not os.path.exists(cache.block_path(2019))
+
+
+def test_zenith_cache_block_evicted_before_load(tmp_path, monkeypatch):
+    """A block removed between its creation and its loading, as by the evict of another process, is created
+    again"""
+    cache = ZenithCache(str(tmp_path), 45., 5., 200)
+    minutes = pd.date_range('2019-03-01', periods=60, freq='min')
+    load = np.load
+    evicted = []
+
+    def evicted_load(path, *args, **kwargs):
+        if not evicted:
+            evicted.append(path)
+            os.remove(path)
+        return load(path, *args, **kwargs)
+
+    monkeypatch.setattr(np, 'load', evicted_load)
+    zenith = cache.get(minutes, lambda times: getZenith(times, 45., 5., 200).to_numpy())
+    assert evicted == [cache.block_path(2019)]
+    np.testing.assert_array_equal(zenith, getZenith(minutes, 45., 5., 200).to_numpy())